@@ -1,5 +1,71 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 admin.site.site_title = 'FoodGram Администрация'
 admin.site.site_header = 'Администрирование Foodgram'
 admin.site.index_title = 'Добро пожаловать, Администратор'
+
+
+def related_count(model, field_name: str):
+    """
+    Число строк model, ссылающихся на строку списка, коррелированным
+    подзапросом: считается только для строк страницы, без GROUP BY
+    по всему соединению.
+    """
+    return Coalesce(Subquery(
+        model.objects.filter(**{field_name: OuterRef('pk')}).order_by()
+        .values(field_name).annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField()), 0)
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр по внешнему ключу с поиском через autocomplete вместо списка
+    всех значений. Связанная модель должна иметь search_fields в админке.
+    """
+    template = 'api/admin/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.parameter_name = f'{self.field_name}__id__exact'
+        super().__init__(request, params, model, model_admin)
+        field = model._meta.get_field(self.field_name)
+        choice_field = forms.ModelChoiceField(
+            queryset=field.related_model.objects.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        self.rendered_widget = choice_field.widget.render(
+            self.parameter_name, self.value())
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.parameter_name]),
+            'display': 'Все',
+        }
+
+
+class AutocompleteFilterMixin:
+    """Подключает статику select2 для AutocompleteFilter в списке."""
+
+    @property
+    def media(self):
+        return (super().media
+                + AutocompleteSelect(None, self.admin_site).media
+                + forms.Media(js=('api/js/autocomplete_filter.js',)))
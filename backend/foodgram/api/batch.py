@@ -0,0 +1,123 @@
+import io
+import json
+import logging
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+
+from .utils import request_cache
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_REQUESTS = getattr(settings, 'BATCH_MAX_REQUESTS', 10)
+# Заголовки тела и условных запросов относятся к самому пакету.
+DROPPED_META = ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_IF_NONE_MATCH',
+                'HTTP_IF_MODIFIED_SINCE', 'HTTP_IDEMPOTENCY_KEY')
+DROPPED_HEADERS = ('Content-Length',)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = serializers.ListField(
+        child=serializers.RegexField(r'^/', max_length=2048),
+        allow_empty=False, max_length=BATCH_MAX_REQUESTS)
+
+
+@lru_cache(maxsize=None)
+def sub_request_handler() -> BaseHandler:
+    """
+    Цепочка MIDDLEWARE и представлений, как у WSGIHandler, но без
+    сигналов начала и конца запроса: соединения с базой закрывает
+    сам пакетный запрос.
+    """
+    handler = BaseHandler()
+    handler.load_middleware()
+    return handler
+
+
+def make_sub_request(request, url) -> WSGIRequest:
+    """
+    GET-запрос с заголовками пакета. Уже проверенный пользователь
+    передаётся как принудительная аутентификация DRF, поэтому токен
+    не проверяется повторно; анонимный запрос аутентифицируется
+    обычным образом, чтобы ошибки доступа совпадали с одиночными.
+    """
+    environ = {key: value for key, value in request.META.items()
+               if key not in DROPPED_META}
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'wsgi.input': io.BytesIO(),
+    })
+    sub_request = WSGIRequest(environ)
+    if request.user.is_authenticated:
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+    sub_request.shared_cache = request_cache(request)
+    sub_request.batched = True
+    return sub_request
+
+
+def close_response(response) -> None:
+    """
+    Закрывает файлы и потоки ответа. HttpResponse.close() ещё и шлёт
+    request_finished, а его close_old_connections закрыл бы соединение
+    пакетного запроса посреди обработки.
+    """
+    for closer in response._resource_closers:
+        closer()
+    response._resource_closers.clear()
+
+
+def response_body(response):
+    if hasattr(response, 'data'):
+        return response.data
+    content = (b''.join(response.streaming_content) if response.streaming
+               else response.content)
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content)
+    return None
+
+
+def run_sub_request(request, path: str, viewsets) -> dict:
+    """
+    Один подзапрос к маршрутам роутера. Он проходит те же middleware,
+    что и одиночный, и ответ отрисовывается: заголовки (Content-Type,
+    X-Frame-Options и другие) совпадают с одиночными. Метрики
+    подзапрос не пишет: его запросы к базе уже учтены в пакетном.
+    """
+    url = urlsplit(path)
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        return {'path': path, 'status': status.HTTP_404_NOT_FOUND,
+                'headers': {}, 'body': {'detail': 'Страница не найдена.'}}
+    if getattr(match.func, 'cls', None) not in viewsets:
+        return {'path': path, 'status': status.HTTP_400_BAD_REQUEST,
+                'headers': {},
+                'body': {'detail': 'Маршрут недоступен в пакетном запросе'}}
+    sub_request = make_sub_request(request, url)
+    try:
+        response = sub_request_handler().get_response(sub_request)
+        try:
+            body = response_body(response)
+        finally:
+            close_response(response)
+    except Exception:
+        logger.exception('Ошибка подзапроса %s', path)
+        return {'path': path,
+                'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                'headers': {},
+                'body': {'detail': 'Внутренняя ошибка сервера'}}
+    return {
+        'path': path,
+        'status': response.status_code,
+        'headers': {name: value for name, value in response.items()
+                    if name not in DROPPED_HEADERS},
+        'body': body,
+    }
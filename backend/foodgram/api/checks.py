@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Лимиты запросов, ключи идемпотентности, версии счётчиков и
+    справочного кэша работают, только если кэш общий для воркеров.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    workers = getattr(settings, 'WEB_CONCURRENCY', 1)
+    if backend in PROCESS_LOCAL_CACHES and workers > 1:
+        return [Error(
+            f'{backend} не общий для {workers} воркеров gunicorn',
+            hint='Укажите CACHE_BACKEND и CACHE_LOCATION общего кэша '
+                 '(memcached из docker-compose) или WEB_CONCURRENCY=1.',
+            id='api.E001',
+        )]
+    return []
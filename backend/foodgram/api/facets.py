@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from recipes.models import Recipe
+
+from .filters import TAGS_ALL
+
+FACETS_CACHE_TTL = getattr(settings, 'RECIPE_COUNT_CACHE_TTL', 300)
+FACET_AUTHORS_LIMIT = 10
+COOKING_TIME_BUCKETS = (15, 30, 60, 120)
+
+
+def tag_facet(queryset):
+    rows = Recipe.tags.through.objects.filter(
+        recipe__in=queryset.order_by().values('id')
+    ).values(
+        'tag_id', 'tag__name', 'tag__color', 'tag__slug'
+    ).annotate(count=Count('recipe_id')).order_by('-count', 'tag_id')
+    return [{
+        'id': row['tag_id'],
+        'name': row['tag__name'],
+        'color': row['tag__color'],
+        'slug': row['tag__slug'],
+        'count': row['count'],
+    } for row in rows]
+
+
+def author_facet(queryset, limit=FACET_AUTHORS_LIMIT):
+    rows = queryset.order_by().values(
+        'author_id', 'author__username'
+    ).annotate(count=Count('id')).order_by('-count', 'author_id')[:limit]
+    return [{
+        'id': row['author_id'],
+        'username': row['author__username'],
+        'count': row['count'],
+    } for row in rows]
+
+
+def cooking_time_facet(queryset, bounds=COOKING_TIME_BUCKETS):
+    bucket = Case(
+        *(When(cooking_time__lte=bound, then=Value(index))
+          for index, bound in enumerate(bounds)),
+        default=Value(len(bounds)),
+        output_field=IntegerField())
+    counts = dict(queryset.order_by().annotate(bucket=bucket).values(
+        'bucket').annotate(count=Count('id')).values_list('bucket', 'count'))
+    lower = 0
+    buckets = []
+    for index, upper in enumerate(bounds + (None,)):
+        buckets.append({'min': lower, 'max': upper,
+                        'count': counts.get(index, 0)})
+        lower = upper + 1 if upper is not None else None
+    return buckets
+
+
+def recipe_facets(filterset) -> dict:
+    """
+    Количества рецептов по тегам, авторам и времени приготовления
+    для набора фильтров: по одному групповому запросу на семейство.
+    При tags_mode=any теги считаются без фильтра по тегам, чтобы
+    показать, сколько рецептов добавит выбор каждого тега.
+    """
+    queryset = filterset.qs
+    tag_queryset = queryset
+    if filterset.form.cleaned_data.get('tags_mode') != TAGS_ALL:
+        data = filterset.data.copy()
+        data.pop('tags', None)
+        tag_queryset = type(filterset)(
+            data, queryset=filterset.queryset, request=filterset.request).qs
+    cooking_time = cooking_time_facet(queryset)
+    return {
+        'count': sum(bucket['count'] for bucket in cooking_time),
+        'tags': tag_facet(tag_queryset),
+        'authors': author_facet(queryset),
+        'cooking_time': cooking_time,
+    }
@@ -2,17 +2,27 @@ import base64
 import uuid
 
 from django.core.files.base import ContentFile
-from rest_framework.serializers import ImageField, ValidationError
+from django.core.files.storage import default_storage
+from rest_framework.serializers import Field, ImageField, ValidationError
+
+from recipes.derivatives import variant_keys
+from recipes.models import Recipe
+from .uploads import UPLOAD_MAX_SIZE
 
 IMAGE_UUID4_NAME = '{}.{}'
 IMAGE64ERROR = 'неверный файл картинки'
+IMAGE64_TOO_LARGE = 'файл картинки слишком большой'
 BASE64 = ";base64,"
 
+image_storage = Recipe._meta.get_field('image').storage
+
 
 class Base64ImageField(ImageField):
     def to_internal_value(self, data):
         try:
             format, imgstr = data.split(BASE64)
+            if len(imgstr) * 3 // 4 > UPLOAD_MAX_SIZE:
+                raise ValidationError(IMAGE64_TOO_LARGE)
             ext = format.split('/')[-1]
             data = ContentFile(
                 base64.b64decode(imgstr),
@@ -21,3 +31,30 @@ class Base64ImageField(ImageField):
         except ValueError:
             raise ValidationError(IMAGE64ERROR)
         return data
+
+
+def image_variant_urls(request, name: str, variants: dict) -> dict:
+    """
+    Ссылки на уменьшенные копии картинки; пока копия не готова,
+    вместо неё отдаётся оригинал.
+    """
+    if not name:
+        return {}
+    build = request.build_absolute_uri if request is not None else str
+    original = build(image_storage.url(name))
+    return {
+        key: (build(default_storage.url(variants[key]))
+              if key in variants else original)
+        for key in variant_keys()
+    }
+
+
+class ImageVariantsField(Field):
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return image_variant_urls(self.context.get('request'),
+                                  recipe.image.name, recipe.image_variants)
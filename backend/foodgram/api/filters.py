@@ -3,6 +3,10 @@ from rest_framework.filters import SearchFilter
 
 from recipes.models import Recipe, Tag
 
+TAGS_ANY = 'any'
+TAGS_ALL = 'all'
+TAGS_MODES = ((TAGS_ANY, 'Любой из тегов'), (TAGS_ALL, 'Все теги'))
+
 
 class IngredientFilter(SearchFilter):
     search_param = 'name'
@@ -10,29 +14,50 @@ class IngredientFilter(SearchFilter):
 
 class CustomFilter(filters.FilterSet):
     """
-    Набор фильтров для рецептов.
+    Набор фильтров для рецептов. Теги проверяются по Recipe.tag_ids
+    без соединения с таблицей связей: tags_mode=any - хотя бы один
+    из тегов, tags_mode=all - все сразу.
     """
 
     author = filters.NumberFilter(field_name='author__id', lookup_expr='exact')
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='get_tags_filter'
     )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES, method='get_tags_mode_filter')
     is_favorited = filters.BooleanFilter(method='get_is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart_filter')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'tags_mode', 'author', 'is_favorited',
+                  'is_in_shopping_cart')
+
+    def get_tags_filter(self, queryset, name, value):
+        tag_ids = [tag.id for tag in value]
+        if not tag_ids:
+            return queryset
+        if self.form.cleaned_data.get('tags_mode') == TAGS_ALL:
+            return queryset.filter(tag_ids__contains=tag_ids)
+        return queryset.filter(tag_ids__overlap=tag_ids)
+
+    def get_tags_mode_filter(self, queryset, name, value):
+        return queryset
 
     def get_is_favorited_filter(self, queryset, name, value):
-        if value:
-            return queryset.filter(users_favorite__user=self.request.user)
-        return queryset
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(users_favorite__user=self.request.user)
 
     def get_is_in_shopping_cart_filter(self, queryset, name, value):
-        if value:
-            return queryset.filter(shopping_list__user=self.request.user)
-        return queryset
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(shopping_list__user=self.request.user)
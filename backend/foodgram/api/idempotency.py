@@ -0,0 +1,51 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import record_cache_lookup
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 15 * 60)
+IDEMPOTENCY_LOCK_TTL = 30
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def idempotent(view_method):
+    """
+    Повтор запроса с тем же заголовком Idempotency-Key отдаёт сохранённый
+    ответ вместо повторного выполнения действия.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        digest = hashlib.sha256(
+            f'{request.user.pk}:{request.method}:{request.path}:{key}'
+            .encode()).hexdigest()
+        cache_key = f'idempotency_{digest}'
+        stored = cache.get(cache_key)
+        record_cache_lookup('idempotency', stored is not None)
+        if stored is not None:
+            data, status_code = stored
+            response = Response(data, status=status_code)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+        lock_key = f'{cache_key}_lock'
+        if not cache.add(lock_key, True, IDEMPOTENCY_LOCK_TTL):
+            return Response(
+                {'detail': 'Запрос с этим ключом ещё выполняется.'},
+                status=status.HTTP_409_CONFLICT)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code < 500:
+                cache.set(cache_key, (response.data, response.status_code),
+                          IDEMPOTENCY_TTL)
+        finally:
+            cache.delete(lock_key)
+        return response
+    return wrapper
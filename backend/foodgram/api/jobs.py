@@ -0,0 +1,147 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from recipes.models import ShoppingListJob
+from .utils import (SHOPPING_LIST_TITLE, cached_pdf, document_digest,
+                    shopping_list_ingredients)
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = getattr(settings, 'SHOPPING_LIST_JOB_WORKERS', 2)
+SYNC_LIMIT = getattr(settings, 'SHOPPING_LIST_SYNC_LIMIT', 20)
+JOB_TTL = getattr(settings, 'SHOPPING_LIST_JOB_TTL', 24 * 60 * 60)
+
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS,
+                              thread_name_prefix='shopping-list')
+
+
+def enqueue_shopping_list(user) -> ShoppingListJob:
+    """
+    Ставит сборку списка покупок в очередь. Ожидающая задача соберёт
+    список, каким он будет при запуске, поэтому возвращается она;
+    выполняемая - только если собирает тот же список, что сейчас
+    в корзине. Ожидающая задача у пользователя одна (уникальный
+    индекс), из двух одновременных запросов второй получит задачу
+    первого.
+    """
+    jobs = ShoppingListJob.objects.filter(user=user)
+    while True:
+        job = jobs.filter(status=ShoppingListJob.PENDING).first()
+        if job is not None:
+            return job
+        digest = document_digest(shopping_list_ingredients(user.id),
+                                 SHOPPING_LIST_TITLE)
+        job = jobs.filter(status=ShoppingListJob.RUNNING,
+                          digest=digest).first()
+        if job is not None:
+            return job
+        try:
+            with transaction.atomic():
+                job = ShoppingListJob.objects.create(user=user, digest=digest)
+        except IntegrityError:
+            continue
+        transaction.on_commit(lambda: executor.submit(run_job, job.pk))
+        return job
+
+
+def claim_job(job_id=None) -> Optional[ShoppingListJob]:
+    """
+    Забирает ожидающую задачу из очереди в таблице. SKIP LOCKED не даёт
+    двум воркерам взять одну и ту же задачу.
+    """
+    with transaction.atomic():
+        jobs = ShoppingListJob.objects.select_for_update(
+            skip_locked=True).filter(status=ShoppingListJob.PENDING)
+        if job_id is not None:
+            jobs = jobs.filter(pk=job_id)
+        job = jobs.order_by('created').first()
+        if job is None:
+            return None
+        job.status = ShoppingListJob.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=('status', 'started'))
+    return job
+
+
+def render_job(job: ShoppingListJob) -> None:
+    """
+    Хэш собираемого списка сохраняется до сборки: по нему новый
+    запрос узнаёт, подойдёт ли ему эта задача.
+    """
+    try:
+        ingredients = shopping_list_ingredients(job.user_id)
+        job.digest = document_digest(ingredients, SHOPPING_LIST_TITLE)
+        job.save(update_fields=('digest',))
+        _, content = cached_pdf(ingredients, SHOPPING_LIST_TITLE, job.digest)
+        job.file.save(f'{job.pk}.pdf', ContentFile(content), save=False)
+        job.status = ShoppingListJob.DONE
+    except Exception:
+        logger.exception('Не удалось собрать список покупок %s', job.pk)
+        job.status = ShoppingListJob.FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=('file', 'status', 'finished'))
+
+
+def run_job(job_id) -> None:
+    """Точка входа потока из пула."""
+    close_old_connections()
+    try:
+        job = claim_job(job_id)
+        if job is not None:
+            render_job(job)
+    finally:
+        close_old_connections()
+
+
+def run_pending() -> int:
+    """Выполняет все ожидающие задачи в текущем процессе."""
+    processed = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return processed
+        render_job(job)
+        processed += 1
+
+
+def requeue_stale(seconds: int) -> int:
+    """
+    Возвращает в очередь задачи, зависшие в работе после падения
+    воркера. Если у пользователя уже есть ожидающая задача, зависшая
+    завершается ошибкой: новый запрос получит ожидающую.
+    """
+    now = timezone.now()
+    stale = ShoppingListJob.objects.filter(
+        status=ShoppingListJob.RUNNING,
+        started__lt=now - timedelta(seconds=seconds))
+    requeued = 0
+    for job_id in stale.values_list('pk', flat=True):
+        job = ShoppingListJob.objects.filter(
+            pk=job_id, status=ShoppingListJob.RUNNING)
+        try:
+            with transaction.atomic():
+                requeued += job.update(status=ShoppingListJob.PENDING,
+                                       started=None)
+        except IntegrityError:
+            job.update(status=ShoppingListJob.FAILED, finished=now)
+    return requeued
+
+
+def purge_finished(seconds: int = JOB_TTL) -> int:
+    """Удаляет старые завершённые задачи вместе с файлами."""
+    jobs = ShoppingListJob.objects.filter(
+        status__in=(ShoppingListJob.DONE, ShoppingListJob.FAILED),
+        finished__lt=timezone.now() - timedelta(seconds=seconds))
+    purged = 0
+    for job in jobs.iterator():
+        job.file.delete(save=False)
+        job.delete()
+        purged += 1
+    return purged
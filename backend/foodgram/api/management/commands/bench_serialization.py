@@ -0,0 +1,56 @@
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.representations import FastRecipeSerializer
+from api.serializers import RecipeViewSerializer
+from recipes.models import Recipe
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ('Compare RecipeViewSerializer with the fast read-only path '
+            'on one page of recipes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', default=6, type=int)
+        parser.add_argument('--repeat', default=200, type=int)
+        parser.add_argument('--user', type=str,
+                            help='email пользователя, от чьего имени запрос')
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = AnonymousUser()
+        if options['user']:
+            try:
+                request.user = CustomUser.objects.get(email=options['user'])
+            except CustomUser.DoesNotExist:
+                raise CommandError('Пользователь не найден')
+        page_size = options['page_size']
+        queryset = Recipe.objects.all()
+        fields, _ = RecipeViewSerializer.get_sparse_fields(request)
+
+        def drf():
+            page = list(queryset.select_related('author').prefetch_related(
+                'tags', 'ingredient_recipe__ingredient')[:page_size])
+            return RecipeViewSerializer(
+                page, many=True, context={'request': request}).data
+
+        def fast():
+            page = FastRecipeSerializer.values(queryset, fields)[:page_size]
+            return FastRecipeSerializer(page, request, fields).data
+
+        renderer = JSONRenderer()
+        if renderer.render(drf()) != renderer.render(fast()):
+            raise CommandError('Быстрый путь расходится с сериализатором')
+        results = {}
+        for name, func in (('serializer', drf), ('fast', fast)):
+            seconds = timeit.timeit(func, number=options['repeat'])
+            results[name] = seconds / options['repeat'] * 1000
+            self.stdout.write(f'{name}: {results[name]:.3f} ms/page')
+        self.stdout.write(self.style.SUCCESS(
+            f'speedup: x{results["serializer"] / results["fast"]:.2f}'))
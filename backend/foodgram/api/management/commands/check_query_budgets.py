@@ -0,0 +1,170 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.jobs import SYNC_LIMIT
+from api.representations import warm_reference_caches
+from api.sample_data import seed_sample_data
+from api.urls import router_v1
+
+PAGE_SIZES = (1, 5, 20)
+# Варианты ответа, которые обходят быстрый путь сериализации.
+VARIANTS = {
+    'recipe-list': ({}, {'view': 'card', 'expand': 'author,tags,'
+                                                   'ingredients,text'}),
+    'recipe-retrieve': ({}, {'view': 'card', 'expand': 'author,tags,'
+                                                       'ingredients,text'}),
+}
+# Публичные действия проверяются ещё и без токена.
+PUBLIC_CASES = ('tag-list', 'tag-retrieve', 'ingredient-list',
+                'ingredient-retrieve', 'recipe-list', 'recipe-retrieve',
+                'recipe-facets', 'recipe-similar')
+BUDGET_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'query-budgets',
+}}
+
+
+def budget_cases():
+    """
+    Действия из query_budgets зарегистрированных представлений:
+    (метка, имя маршрута, нужен ли id объекта, модель, бюджет, методы).
+    Действия без GET проверяются своими методами: POST, затем DELETE.
+    """
+    for _, viewset, basename in router_v1.registry:
+        for action, budget in getattr(viewset, 'query_budgets', {}).items():
+            methods = ('get',)
+            if action == 'list':
+                url_name, detail = f'{basename}-list', False
+            elif action == 'retrieve':
+                url_name, detail = f'{basename}-detail', True
+            else:
+                method = getattr(viewset, action)
+                mapping = getattr(method, 'mapping', {})
+                if 'get' not in mapping:
+                    methods = tuple(name for name in ('post', 'delete')
+                                    if name in mapping)
+                if not methods:
+                    raise CommandError(
+                        f'{basename}-{action}: бюджет задан для действия '
+                        f'без GET, POST и DELETE')
+                url_name = f'{basename}-{method.url_name}'
+                detail = method.detail
+            lookup = viewset.lookup_url_kwarg or viewset.lookup_field
+            yield (f'{basename}-{action}', url_name,
+                   lookup if detail else None, viewset, budget, methods)
+
+
+class Command(BaseCommand):
+    help = ('Run every action with a declared query budget against a '
+            'seeded test database (GET at several page sizes, write '
+            'actions as POST then DELETE) and fail when a budget is '
+            'exceeded or the query count grows with page size')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', default=PAGE_SIZES, nargs='+',
+                            type=int)
+        parser.add_argument('--keepdb', action='store_true')
+
+    def handle(self, *args, **options):
+        page_sizes = sorted(options['page_sizes'])
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     keepdb=options['keepdb'])
+        try:
+            with override_settings(CACHES=BUDGET_CACHES):
+                failures = self.measure(page_sizes)
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
+            teardown_test_environment()
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Бюджеты запросов соблюдены'))
+
+    def measure(self, page_sizes):
+        # Список покупок не больше SYNC_LIMIT: PDF собирается сразу.
+        # Последний рецепт не у читателя: его добавляют и удаляют.
+        reader = seed_sample_data(
+            max(page_sizes),
+            reader_items=min(SYNC_LIMIT, max(page_sizes)))
+        # Как после деплоя: справочные объекты уже в кэше процесса.
+        warm_reference_caches()
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=reader)}')
+        failures = []
+        for (label, url_name, lookup, viewset, budget,
+             methods) in budget_cases():
+            kwargs = {}
+            if lookup:
+                kwargs[lookup] = viewset.queryset.model.objects.order_by(
+                    '-pk').values_list('pk', flat=True).first()
+            url = reverse(url_name, kwargs=kwargs)
+            if methods != ('get',):
+                failures.extend(
+                    self.measure_writes(client, label, url, budget, methods))
+                continue
+            if label in PUBLIC_CASES:
+                failures.extend(self.measure_anonymous(label, url, budget))
+            for params in VARIANTS.get(label, ({},)):
+                counts = []
+                for size in page_sizes:
+                    cache.clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.get(url, {
+                            **params, 'limit': size, 'recipes_limit': size})
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                    if response.status_code >= 400:
+                        failures.append(
+                            f'{label} {params}: ответ {response.status_code}')
+                    counts.append(len(queries))
+                name = f'{label} {params}' if params else label
+                self.stdout.write(
+                    f'{name}: {counts} (бюджет {budget})')
+                if max(counts) > budget:
+                    failures.append(
+                        f'{name}: {max(counts)} запросов при бюджете '
+                        f'{budget}')
+                if counts[-1] > counts[0]:
+                    failures.append(
+                        f'{name}: число запросов растёт с размером '
+                        f'страницы {counts}')
+        return failures
+
+    def measure_anonymous(self, label, url, budget):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.stdout.write(
+            f'{label} без токена: {len(queries)} (бюджет {budget})')
+        if response.status_code >= 400:
+            return [f'{label} без токена: ответ {response.status_code}']
+        if len(queries) > budget:
+            return [f'{label} без токена: {len(queries)} запросов при '
+                    f'бюджете {budget}']
+        return []
+
+    def measure_writes(self, client, label, url, budget, methods):
+        failures = []
+        for method in methods:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, method)(url)
+            name = f'{label} {method.upper()}'
+            self.stdout.write(f'{name}: {len(queries)} (бюджет {budget})')
+            if response.status_code >= 400:
+                failures.append(f'{name}: ответ {response.status_code}')
+            if len(queries) > budget:
+                failures.append(
+                    f'{name}: {len(queries)} запросов при бюджете {budget}')
+        return failures
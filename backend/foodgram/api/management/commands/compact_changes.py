@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.sync import SYNC_RETENTION
+from recipes.changes import compact_changes
+
+
+class Command(BaseCommand):
+    help = ('Compact the sync change log: drop expired entries, entries of '
+            'deleted users and all but the latest entry per object')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention', default=SYNC_RETENTION, type=int)
+
+    def handle(self, *args, **options):
+        removed = compact_changes(options['retention'])
+        self.stdout.write(self.style.SUCCESS(
+            'Удалено записей: устаревших {expired}, удалённых '
+            'пользователей {orphaned}, повторов {duplicates}'.format(
+                **removed)))
@@ -0,0 +1,248 @@
+import json
+import os
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import setup_databases, teardown_databases
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.filters import TAGS_ALL
+from api.representations import FastRecipeSerializer
+from api.sample_data import seed_sample_data
+from api.serializers import RecipeViewSerializer
+from api.utils import shopping_list_items
+from api.views import RecipeViewset, subscription_queryset
+from recipes.models import Recipe, ShoppingList, Tag
+from users.models import CustomUser
+
+BASELINE_PATH = getattr(settings, 'EXPLAIN_BASELINE_PATH', os.path.join(
+    settings.BASE_DIR, 'explain_baselines.json'))
+PAGE_SIZE = 6
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan',
+               'Bitmap Heap Scan'}
+PLAN_KEYS = (('Relation Name', 'relation'), ('Index Name', 'index'),
+             ('Join Type', 'join'), ('Strategy', 'strategy'))
+
+
+def recipe_page(user, params: dict):
+    """Первая страница списка рецептов так, как её строит RecipeViewset."""
+    request = Request(APIRequestFactory().get('/api/recipes/', params))
+    request.user = user
+    view = RecipeViewset(request=request, action='list', format_kwarg=None,
+                         args=(), kwargs={})
+    fields, _ = RecipeViewSerializer.get_sparse_fields(request)
+    return FastRecipeSerializer.values(
+        view.filter_queryset(view.get_queryset()), fields)[:PAGE_SIZE]
+
+
+def representative_queries(user) -> Dict[str, object]:
+    tags = list(Tag.objects.order_by('id').values_list('slug', flat=True)[:2])
+    author = Recipe.objects.order_by().values('author_id').annotate(
+        recipes=Count('id')).order_by('-recipes').first()
+    return {
+        'recipe_list': recipe_page(user, {}),
+        'recipe_list_tags_any': recipe_page(user, {'tags': tags}),
+        'recipe_list_tags_all': recipe_page(
+            user, {'tags': tags, 'tags_mode': TAGS_ALL}),
+        'recipe_list_author': recipe_page(
+            user, {'author': author['author_id'] if author else 0}),
+        'recipe_list_favorited': recipe_page(user, {'is_favorited': 1}),
+        'recipe_list_in_cart': recipe_page(
+            user, {'is_in_shopping_cart': 1}),
+        'shopping_cart_items': shopping_list_items(user.id),
+        'subscriptions': subscription_queryset(user)[:PAGE_SIZE],
+    }
+
+
+def normalize(node: dict) -> dict:
+    """Узел плана без времени и буферов: только то, что стоит сравнивать."""
+    normalized = {'node': node['Node Type']}
+    for key, name in PLAN_KEYS:
+        if key in node:
+            normalized[name] = node[key]
+    normalized['rows'] = node['Plan Rows']
+    normalized['cost'] = node['Total Cost']
+    if 'Plans' in node:
+        normalized['children'] = [normalize(child) for child in node['Plans']]
+    return normalized
+
+
+def explain(queryset) -> dict:
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+        transaction.set_rollback(True)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]['Plan']
+    return {
+        'plan': normalize(root),
+        'execution_ms': plan[0]['Execution Time'],
+        'shared_hit': root.get('Shared Hit Blocks', 0),
+        'shared_read': root.get('Shared Read Blocks', 0),
+    }
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get('children', ()):
+        yield from walk(child)
+
+
+def scans_by_relation(plan: dict) -> Dict[str, set]:
+    scans = {}
+    for node in walk(plan):
+        if 'relation' in node:
+            scans.setdefault(node['relation'], set()).add(node['node'])
+    return scans
+
+
+def relations(node: dict) -> List[str]:
+    return sorted({item['relation'] for item in walk(node)
+                   if 'relation' in item})
+
+
+def nodes_by_key(plan: dict) -> Dict[str, dict]:
+    """
+    Узлы плана по ключу: чтение таблицы - по её имени, остальные узлы -
+    по типу и таблицам под ними. Из одинаковых ключей берётся узел
+    с наибольшей оценкой строк.
+    """
+    nodes = {}
+    for node in walk(plan):
+        if 'relation' in node:
+            key = node['relation']
+        else:
+            key = f'{node["node"]}({", ".join(relations(node))})'
+        if key not in nodes or node['rows'] > nodes[key]['rows']:
+            nodes[key] = node
+    return nodes
+
+
+def shape(plan: dict) -> List[tuple]:
+    return [(node['node'], node.get('relation'), node.get('index'))
+            for node in walk(plan)]
+
+
+def compare(name: str, baseline: dict, current: dict,
+            rows_factor: float, cost_factor: float):
+    """
+    Регрессии (проваливают проверку) и заметные изменения плана.
+    Оценки строк и стоимость сравниваются у совпадающих узлов всего
+    дерева: у корня Limit оценка строк всегда равна размеру страницы.
+    """
+    regressions, changes = [], []
+    old_scans = scans_by_relation(baseline['plan'])
+    for relation, kinds in scans_by_relation(current['plan']).items():
+        previous = old_scans.get(relation, set())
+        if ('Seq Scan' in kinds and 'Seq Scan' not in previous
+                and previous & INDEX_SCANS):
+            regressions.append(
+                f'{name}: Seq Scan по {relation} вместо '
+                f'{", ".join(sorted(previous & INDEX_SCANS))}')
+    old, new = baseline['plan'], current['plan']
+    old_nodes = nodes_by_key(old)
+    for key, node in nodes_by_key(new).items():
+        previous = old_nodes.get(key)
+        if previous is None:
+            continue
+        if node['rows'] > max(previous['rows'], 1) * rows_factor:
+            regressions.append(
+                f'{name}: {key}: оценка строк '
+                f'{previous["rows"]} -> {node["rows"]}')
+        if node['cost'] > max(previous['cost'], 1) * cost_factor:
+            regressions.append(
+                f'{name}: {key}: стоимость '
+                f'{previous["cost"]:.1f} -> {node["cost"]:.1f}')
+    if shape(old) != shape(new):
+        changes.append(f'{name}: план изменился')
+    return regressions, changes
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN (ANALYZE, BUFFERS) on the main recipe, filter, '
+            'shopping cart and subscription queries, store normalized '
+            'plans as baselines and report plan regressions against them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=BASELINE_PATH)
+        parser.add_argument('--update', action='store_true',
+                            help='Записать текущие планы как базовые')
+        parser.add_argument('--user', type=str,
+                            help='email пользователя для фильтров '
+                                 'избранного, списка покупок и подписок')
+        parser.add_argument('--seed', type=int, metavar='AUTHORS',
+                            help='Проверить на тестовой базе с AUTHORS '
+                                 'авторами вместо текущей')
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--rows-factor', default=10.0, type=float)
+        parser.add_argument('--cost-factor', default=3.0, type=float)
+
+    def handle(self, *args, **options):
+        if not options['seed']:
+            return self.run(self.get_user(options['user']), options)
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     keepdb=options['keepdb'])
+        try:
+            user = seed_sample_data(options['seed'], tags=40,
+                                    reader_items=50)
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM ANALYZE')
+            self.run(user, options)
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
+
+    def get_user(self, email):
+        if email:
+            user = CustomUser.objects.filter(email=email).first()
+        else:
+            user_id = ShoppingList.objects.values('user_id').annotate(
+                items=Count('id')).order_by('-items').values_list(
+                'user_id', flat=True).first()
+            user = CustomUser.objects.filter(pk=user_id).first()
+        if user is None:
+            raise CommandError('Пользователь не найден')
+        return user
+
+    def run(self, user, options):
+        current = {name: explain(queryset) for name, queryset
+                   in representative_queries(user).items()}
+        for name, result in current.items():
+            plan = result['plan']
+            self.stdout.write(
+                f'{name}: {plan["node"]}, cost {plan["cost"]:.1f}, '
+                f'rows {plan["rows"]}, {result["execution_ms"]:.2f} ms, '
+                f'buffers {result["shared_hit"]}/{result["shared_read"]}')
+        path = options['baseline']
+        if options['update']:
+            with open(path, 'w') as file:
+                json.dump(current, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовые планы записаны в {path}'))
+            return
+        if not os.path.exists(path):
+            raise CommandError(
+                f'Нет базовых планов {path}; запустите с --update')
+        with open(path) as file:
+            baselines = json.load(file)
+        regressions = []
+        for name, result in current.items():
+            if name not in baselines:
+                self.stdout.write(f'{name}: нет базового плана')
+                continue
+            found, changes = compare(
+                name, baselines[name], result,
+                options['rows_factor'], options['cost_factor'])
+            regressions += found
+            for change in changes:
+                self.stdout.write(self.style.WARNING(change))
+        if regressions:
+            raise CommandError('\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий планов нет'))
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+BOOT_BUDGET_MS = getattr(settings, 'BOOT_TIME_BUDGET_MS', 1500)
+# Pillow сюда не входит: его при загрузке моделей импортирует colorfield.
+LAZY_MODULES = ('reportlab',)
+BOOT_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({'ready_ms': (time.perf_counter() - started) * 1000}))
+'''
+
+
+def parse_importtime(output: str) -> dict:
+    """Суммарное время импорта по пакетам верхнего уровня, мс."""
+    packages = defaultdict(float)
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1000
+    return packages
+
+
+class Command(BaseCommand):
+    help = ('Report per-package import time of a fresh worker boot and fail '
+            'when it exceeds the budget or loads modules meant to be lazy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', default=BOOT_BUDGET_MS,
+                            type=float)
+        parser.add_argument('--top', default=15, type=int)
+        parser.add_argument('--runs', default=3, type=int,
+                            help='Сколько раз запускать, берётся лучший')
+        parser.add_argument('--lazy', nargs='*', default=LAZY_MODULES,
+                            help='Пакеты, которых не должно быть при запуске')
+
+    def boot(self):
+        env = {**os.environ,
+               'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+            capture_output=True, text=True, cwd=settings.BASE_DIR, env=env)
+        if result.returncode:
+            raise CommandError(result.stderr[-2000:])
+        ready_ms = json.loads(result.stdout.strip().splitlines()[-1])[
+            'ready_ms']
+        return ready_ms, parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        ready_ms, packages = min(
+            (self.boot() for _ in range(options['runs'])),
+            key=lambda run: run[0])
+        for name, spent in sorted(packages.items(), key=lambda item: -item[1])[
+                :options['top']]:
+            self.stdout.write(f'{spent:9.1f} ms  {name}')
+        self.stdout.write(f'Импорт модулей: {sum(packages.values()):.1f} мс, '
+                          f'запуск до готовности: {ready_ms:.1f} мс')
+        loaded = [name for name in options['lazy'] if name in packages]
+        if loaded:
+            raise CommandError(
+                f'При запуске загружены ленивые модули: {", ".join(loaded)}')
+        if ready_ms > options['budget_ms']:
+            raise CommandError(
+                f'Запуск занял {ready_ms:.1f} мс при бюджете '
+                f'{options["budget_ms"]:.0f} мс')
+        self.stdout.write(self.style.SUCCESS('Бюджет запуска соблюдён'))
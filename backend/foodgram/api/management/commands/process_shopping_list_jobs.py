@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import JOB_TTL, purge_finished, requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Process queued shopping list PDF jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', default=2.0, type=float)
+        parser.add_argument('--stale-after', default=10 * 60, type=int)
+        parser.add_argument('--purge-after', default=JOB_TTL, type=int)
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale(options['stale_after'])
+            processed = run_pending()
+            purged = purge_finished(options['purge_after'])
+            if processed or requeued or purged or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Выполнено задач: {processed}, '
+                    f'возвращено в очередь: {requeued}, удалено: {purged}'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
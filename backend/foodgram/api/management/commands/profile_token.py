@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.profiling import (PROFILE_HEADER, PROFILE_TOKEN_MAX_AGE,
+                           make_profile_token)
+
+
+class Command(BaseCommand):
+    help = 'Issue a signed token that enables profiling of a request'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profile_token())
+        self.stdout.write(self.style.SUCCESS(
+            f'Передайте его в заголовке {PROFILE_HEADER}; '
+            f'действует {PROFILE_TOKEN_MAX_AGE} с'))
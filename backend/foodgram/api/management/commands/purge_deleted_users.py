@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.purge import PURGE_BATCH_SIZE, requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = ('Delete data of soft-deleted accounts in batches; interrupted '
+            'deletions are resumed from the last finished batch')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', default=10.0, type=float)
+        parser.add_argument('--batch-size', default=PURGE_BATCH_SIZE,
+                            type=int)
+        parser.add_argument('--stale-after', default=10 * 60, type=int)
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale(options['stale_after'])
+            processed = run_pending(options['batch_size'])
+            if processed or requeued or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Удалено аккаунтов: {processed}, '
+                    f'возвращено в очередь: {requeued}'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.uploads import UPLOAD_TTL, purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete image uploads that were never attached to a recipe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', default=UPLOAD_TTL, type=int)
+
+    def handle(self, *args, **options):
+        purged = purge_stale_uploads(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {purged}'))
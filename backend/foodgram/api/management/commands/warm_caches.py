@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.checks import PROCESS_LOCAL_CACHES
+from api.representations import WARM_AUTHORS, warm_reference_caches
+
+
+class Command(BaseCommand):
+    help = ('Fill the shared reference cache with tags, ingredients and '
+            'profiles of the most recently active authors after a deploy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', default=WARM_AUTHORS, type=int,
+                            help='Сколько последних активных авторов '
+                                 'загрузить')
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            raise CommandError(
+                f'{backend} хранит кэш в памяти этой команды, воркеры '
+                'его не увидят. Укажите общий кэш в CACHE_BACKEND.')
+        warmed = warm_reference_caches(options['authors'])
+        self.stdout.write(self.style.SUCCESS(
+            'В кэше тегов: {tags}, ингредиентов: {ingredients}, '
+            'авторов: {authors}'.format(**warmed)))
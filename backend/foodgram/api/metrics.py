@@ -0,0 +1,360 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+METRICS_DIR = getattr(settings, 'METRICS_DIR', 'metrics')
+METRICS_PREFIX = 'foodgram_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+RENDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MmapValues:
+    """
+    Значения метрик одного процесса в файле, отображённом в память.
+    Первые 8 байт - занятый объём; дальше записи: длина ключа (4 байта),
+    ключ с выравниванием до 8 байт и значение double. Заголовок
+    обновляется после записи, поэтому читатель из другого процесса
+    не увидит запись наполовину.
+    """
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(self.INITIAL_SIZE)
+        self.capacity = os.fstat(self.file.fileno()).st_size
+        self.mmap = mmap.mmap(self.file.fileno(), self.capacity)
+        self.used = struct.unpack_from('Q', self.mmap)[0] or 8
+        self.positions = {key: position for key, _, position
+                          in read_entries(self.mmap, self.used)}
+
+    def allocate(self, key: str) -> int:
+        encoded = key.encode()
+        padding = -(4 + len(encoded)) % 8
+        entry = (struct.pack('i', len(encoded)) + encoded + b' ' * padding
+                 + struct.pack('d', 0.0))
+        while self.used + len(entry) > self.capacity:
+            self.capacity *= 2
+            self.mmap.close()
+            self.file.truncate(self.capacity)
+            self.mmap = mmap.mmap(self.file.fileno(), self.capacity)
+        self.mmap[self.used:self.used + len(entry)] = entry
+        self.used += len(entry)
+        struct.pack_into('Q', self.mmap, 0, self.used)
+        position = self.used - 8
+        self.positions[key] = position
+        return position
+
+    def increment(self, key: str, amount: float) -> None:
+        position = self.positions.get(key)
+        if position is None:
+            position = self.allocate(key)
+        value = struct.unpack_from('d', self.mmap, position)[0]
+        struct.pack_into('d', self.mmap, position, value + amount)
+
+    def close(self) -> None:
+        self.mmap.close()
+        self.file.close()
+
+
+def read_entries(data, used: int) -> Iterator[Tuple[str, float, int]]:
+    offset = 8
+    while offset < used:
+        length = struct.unpack_from('i', data, offset)[0]
+        key = bytes(data[offset + 4:offset + 4 + length]).decode()
+        offset += 4 + length + (-(4 + length) % 8)
+        yield key, struct.unpack_from('d', data, offset)[0], offset
+        offset += 8
+
+
+ARCHIVE_NAME = 'archive.db'
+LOCK_NAME = '.lock'
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def metrics_lock(shared: bool = False):
+    """
+    Блокировка каталога метрик: исключительная на перенос файлов
+    завершившихся процессов, разделяемая на чтение.
+    """
+    lock = open(os.path.join(METRICS_DIR, LOCK_NAME), 'a')
+    fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    return lock
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Переносит значения процесса в archive.db и удаляет его файл,
+    чтобы счётчики не сбрасывались, а файлы не копились.
+    """
+    path = os.path.join(METRICS_DIR, f'{pid}.db')
+    with metrics_lock():
+        if not os.path.exists(path) or process_alive(pid):
+            return
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) >= 8:
+            archive = MmapValues(os.path.join(METRICS_DIR, ARCHIVE_NAME))
+            for key, value, _ in read_entries(
+                    data, struct.unpack_from('Q', data)[0]):
+                archive.increment(key, value)
+            archive.close()
+        os.remove(path)
+
+
+def collect_dead_processes() -> None:
+    """Файлы процессов, которых уже нет, переносятся в archive.db."""
+    for entry in os.scandir(METRICS_DIR):
+        pid = entry.name[:-len('.db')]
+        if (entry.name.endswith('.db') and pid.isdigit()
+                and int(pid) != os.getpid() and not process_alive(int(pid))):
+            mark_process_dead(int(pid))
+
+
+class ProcessStore:
+    """
+    Файл значений текущего процесса в METRICS_DIR. У каждого воркера
+    gunicorn и фонового процесса свой файл, экспозиция суммирует все.
+    При запуске процесс переносит файлы завершившихся процессов
+    в archive.db: счётчики продолжают расти после перезапуска воркеров.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.values = None
+
+    def increment(self, key: str, amount: float) -> None:
+        with self.lock:
+            if self.pid != os.getpid():
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                collect_dead_processes()
+                with metrics_lock():
+                    self.values = MmapValues(
+                        os.path.join(METRICS_DIR, f'{os.getpid()}.db'))
+                self.pid = os.getpid()
+            self.values.increment(key, amount)
+
+
+store = ProcessStore()
+registry = []
+
+
+def collect() -> Dict[str, dict]:
+    """
+    Сумма значений по файлам всех процессов:
+    {метрика: {метки: {суффикс: значение}}}.
+    """
+    totals = defaultdict(float)
+    if os.path.isdir(METRICS_DIR):
+        with metrics_lock(shared=True):
+            for entry in os.scandir(METRICS_DIR):
+                if not entry.name.endswith('.db'):
+                    continue
+                with open(entry.path, 'rb') as file:
+                    data = file.read()
+                if len(data) < 8:
+                    continue
+                for key, value, _ in read_entries(
+                        data, struct.unpack_from('Q', data)[0]):
+                    totals[key] += value
+    metrics = defaultdict(lambda: defaultdict(dict))
+    for key, value in totals.items():
+        name, suffix, labels = json.loads(key)
+        metrics[name][tuple(map(tuple, labels))][suffix] = value
+    return metrics
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, value.replace('\\', r'\\')
+                         .replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def key(self, suffix: str, labels: dict) -> str:
+        return json.dumps([self.name, suffix, [
+            [name, str(labels[name])] for name in self.labelnames]])
+
+    def samples(self, labels: tuple, values: dict) -> Iterator[str]:
+        raise NotImplementedError
+
+    def expose(self, metrics: Dict[str, dict]) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        series = metrics.get(self.name, {})
+        for labels in sorted(series):
+            yield from self.samples(labels, series[labels])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        store.increment(self.key('_total', labels), amount)
+
+    def samples(self, labels, values):
+        yield (f'{self.name}_total{format_labels(labels)} '
+               f'{values.get("_total", 0)}')
+
+
+class Histogram(Metric):
+    """
+    Гистограмма: в файле хранятся попадания в каждый интервал,
+    накопительные значения bucket считаются при экспозиции.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        for bound in self.buckets:
+            if value <= bound:
+                store.increment(self.key(f'_bucket:{bound}', labels), 1)
+                break
+        store.increment(self.key('_sum', labels), value)
+        store.increment(self.key('_count', labels), 1)
+
+    def samples(self, labels, values):
+        cumulative = 0
+        for bound in self.buckets:
+            cumulative += values.get(f'_bucket:{bound}', 0)
+            yield (f'{self.name}_bucket'
+                   f'{format_labels(labels + (("le", str(bound)),))} '
+                   f'{cumulative}')
+        count = values.get('_count', 0)
+        yield (f'{self.name}_bucket'
+               f'{format_labels(labels + (("le", "+Inf"),))} {count}')
+        yield f'{self.name}_sum{format_labels(labels)} {values.get("_sum", 0)}'
+        yield f'{self.name}_count{format_labels(labels)} {count}'
+
+
+def render_metrics() -> str:
+    """Текстовый формат экспозиции Prometheus."""
+    metrics = collect()
+    return '\n'.join(
+        line for metric in registry for line in metric.expose(metrics)) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки запроса по представлениям DRF',
+    ('view', 'method'))
+REQUESTS = Counter(
+    'http_requests', 'Запросы по представлениям и кодам ответа',
+    ('view', 'method', 'status'))
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Запросов к базе на один HTTP-запрос',
+    ('view',), QUERY_BUCKETS)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups', 'Обращения к кэшу: попадания и промахи',
+    ('cache', 'result'))
+PDF_RENDER = Histogram(
+    'pdf_render_duration_seconds', 'Время сборки PDF', (), RENDER_BUCKETS)
+THROTTLED = Counter(
+    'throttled_requests', 'Запросы, отклонённые лимитами', ('scope',))
+
+
+def record_cache_lookup(cache_name: str, hit: bool, amount: int = 1) -> None:
+    if amount:
+        CACHE_LOOKUPS.inc(amount, cache=cache_name,
+                          result='hit' if hit else 'miss')
+
+
+class QueryCounter:
+    """Обёртка выполнения запросов, считающая их число."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Длительность, код ответа и число запросов к базе для каждого запроса;
+    у потоковых ответов - с учётом выдачи тела.
+    Представление подписывается именем маршрута: recipe-list,
+    recipe-download-shopping-cart, users-subscriptions. Подзапросы
+    пакета не пишутся, их учитывает сам пакетный запрос.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if getattr(request, 'batched', False):
+            return self.get_response(request)
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, queries,
+                started)
+        else:
+            self.record(request, response, queries, started)
+        return response
+
+    def stream(self, content, request, response, queries, started):
+        """Запросы при выдаче потокового ответа тоже считаются."""
+        try:
+            with connection.execute_wrapper(queries):
+                yield from content
+        finally:
+            self.record(request, response, queries, started)
+
+    @staticmethod
+    def record(request, response, queries, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        REQUEST_LATENCY.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method,
+                     status=response.status_code)
+        DB_QUERIES.observe(queries.count, view=view)
+
+
+def metrics_view(request):
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
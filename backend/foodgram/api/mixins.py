@@ -0,0 +1,106 @@
+import os
+
+from django.db import connection
+from django.http import StreamingHttpResponse
+
+from .metrics import QueryCounter
+from .profiling import (PROFILING_ENABLED, ProfileSession, profile_reason,
+                        profiler_lock)
+from .query_budgets import (QUERY_BUDGET_WARNINGS, QUERY_COUNT_HEADER,
+                            report_query_count)
+from .renderers import StreamingJSONRenderer
+
+
+class StreamingListMixin:
+    """
+    Потоковая выдача непагинированного списка: объекты читаются
+    из queryset.iterator() пачками и сразу пишутся в ответ.
+    """
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        renderer_context = self.get_renderer_context()
+        if (self.paginator is not None
+                or not isinstance(renderer, StreamingJSONRenderer)
+                or not renderer.can_stream(request.accepted_media_type,
+                                           renderer_context)):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        items = (
+            serializer.to_representation(obj)
+            for obj in queryset.iterator(chunk_size=self.stream_chunk_size)
+        )
+        return StreamingHttpResponse(
+            renderer.render_stream(items),
+            content_type=renderer.media_type
+        )
+
+
+class RateLimitHeadersMixin:
+    """Заголовки RateLimit-* по итогам проверки TokenBucketThrottle."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        for header, value in getattr(request, 'rate_limit', {}).items():
+            response[header] = value
+        return response
+
+
+class ProfilingMixin:
+    """
+    Профилирование запроса по подписанному заголовку X-Profile-Token,
+    по ?profile=1 от сотрудника или по случайной выборке. Пока
+    PROFILING_ENABLED выключен, обработка запроса не меняется.
+    """
+    profile_session = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not PROFILING_ENABLED:
+            return
+        reason = profile_reason(request)
+        if reason and profiler_lock.acquire(blocking=False):
+            self.profile_session = ProfileSession(reason)
+            self.profile_session.start()
+
+    def dispatch(self, request, *args, **kwargs):
+        if not PROFILING_ENABLED:
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            session = self.profile_session
+            if session is None:
+                return response
+            session.mark('view')
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            session.mark('render')
+        finally:
+            if self.profile_session is not None:
+                self.profile_session.stop()
+                profiler_lock.release()
+        path = session.save(self.request, self)
+        response['X-Profile-Id'] = os.path.basename(path)
+        return response
+
+
+class QueryBudgetMixin:
+    """
+    Предел числа запросов к базе по действиям: query_budgets = {'list': 5}.
+    Его проверяет команда check_query_budgets; при DEBUG превышение ещё
+    и пишется в лог, а число запросов отдаётся в заголовке X-Query-Count.
+    """
+    query_budgets = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        if not QUERY_BUDGET_WARNINGS:
+            return super().dispatch(request, *args, **kwargs)
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = super().dispatch(request, *args, **kwargs)
+        response[QUERY_COUNT_HEADER] = str(queries.count)
+        report_query_count(self, queries.count)
+        return response
@@ -1,7 +1,188 @@
+import hashlib
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db import connection
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from .metrics import record_cache_lookup
+
+ESTIMATED_COUNT_THRESHOLD = getattr(
+    settings, 'ESTIMATED_COUNT_THRESHOLD', 100000)
+# Больше строк точно не считается: дальше берётся оценка планировщика.
+EXACT_COUNT_LIMIT = getattr(settings, 'RECIPE_EXACT_COUNT_LIMIT', 1000)
+COUNT_CACHE_TTL = getattr(settings, 'RECIPE_COUNT_CACHE_TTL', 300)
+COUNT_VERSION_KEY = 'recipe_count_version'
+USER_SCOPED_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def estimated_table_count(model) -> int:
+    """Оценка числа строк таблицы по статистике Postgres (reltuples)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class '
+            'WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: без фильтров и выше порога
+    ESTIMATED_COUNT_THRESHOLD берёт оценку Postgres вместо COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_table_count(self.object_list.model)
+            if estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        # Аннотации для колонок списка в подсчёте не нужны.
+        return self.object_list.values('pk').count()
+
+
+def estimated_query_count(queryset) -> int:
+    """Оценка числа строк запроса: reltuples без фильтров, иначе EXPLAIN."""
+    if not queryset.query.where:
+        return estimated_table_count(queryset.model)
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def uses_user_filters(request) -> bool:
+    return any(request.query_params.get(name) not in (None, '', '0', 'false')
+               for name in USER_SCOPED_FILTERS)
+
+
+def filter_cache_key(prefix: str, request, view) -> str:
+    """
+    Ключ кэша по нормализованным параметрам фильтра представления
+    и версии, которую сбрасывает invalidate_recipe_counts.
+    """
+    params = request.query_params
+    filterset_class = getattr(view, 'filterset_class', None)
+    names = (filterset_class.base_filters if filterset_class
+             else set(params) - {'page', 'limit'})
+    normalized = sorted(
+        (name, sorted(params.getlist(name)))
+        for name in names if name in params)
+    version = cache.get(COUNT_VERSION_KEY, 0)
+    digest = hashlib.sha1(
+        repr((view.basename, normalized)).encode()).hexdigest()
+    return f'{prefix}_{version}_{digest}'
+
+
+def invalidate_recipe_counts() -> None:
+    """Сбрасывает все закэшированные количества рецептов."""
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNT_VERSION_KEY, 1, None)
+
+
+class CountedPage(Page):
+    """Страница при оценочном количестве: следующая есть у полной."""
+
+    def has_next(self):
+        return len(self.object_list) == self.paginator.per_page
+
+
+class CountingPaginator(Paginator):
+    """
+    Пагинатор с подсчётом через кэш. Без кэша выполняется COUNT(*)
+    не более чем по EXACT_COUNT_LIMIT строкам. Если строк больше,
+    количество - оценка планировщика (не меньше EXACT_COUNT_LIMIT)
+    и count_exact = False: COUNT(*) большого списка с фильтрами
+    читал бы все его строки.
+    """
+
+    def __init__(self, *args, cache_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_key = cache_key
+        self._count_exact = True
+
+    @cached_property
+    def count(self):
+        if self.cache_key is not None:
+            cached = cache.get(self.cache_key)
+            record_cache_lookup('recipe_count', cached is not None)
+            if cached is not None:
+                count, self._count_exact = cached
+                return count
+        count = self.object_list.order_by().values('pk')[
+            :EXACT_COUNT_LIMIT].count()
+        if count >= EXACT_COUNT_LIMIT:
+            count = max(count, estimated_query_count(
+                self.object_list.order_by()))
+            self._count_exact = False
+        if self.cache_key is not None:
+            cache.set(self.cache_key, (count, self._count_exact),
+                      COUNT_CACHE_TTL)
+        return count
+
+    @property
+    def count_exact(self):
+        return self.count is not None and self._count_exact
+
+    def validate_number(self, number):
+        if self.count_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return CountedPage(
+            self.object_list[bottom:bottom + self.per_page], number, self)
 
 
 class RecipePagination(PageNumberPagination):
-    """Пагинация рецептов"""
+    """
+    Пагинация рецептов. Для представлений с cache_counts = True
+    количество кэшируется по нормализованному набору фильтров;
+    в ответе count_exact показывает, точное ли оно.
+    """
     page_size = 6
     page_size_query_param = 'limit'
+
+    def get_count_cache_key(self, request, view):
+        if (not getattr(view, 'cache_counts', False)
+                or uses_user_filters(request)):
+            return None
+        return filter_cache_key('recipe_count', request, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CountingPaginator,
+            cache_key=self.get_count_cache_key(request, view))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_exact', self.page.paginator.count_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,147 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Optional
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+PROFILING_ENABLED = getattr(settings, 'PROFILING_ENABLED', False)
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR', 'profiles')
+PROFILE_RETENTION = getattr(settings, 'PROFILE_RETENTION', 50)
+PROFILE_TOKEN_MAX_AGE = getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 60 * 60)
+PROFILE_QUERY_PARAM = 'profile'
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_SALT = 'api.profiling'
+TOP_ALLOCATIONS = 20
+SERIALIZER_MODULES = ('rest_framework/serializers.py',
+                      'api/representations.py')
+
+# cProfile не допускает двух активных профилировщиков одновременно.
+profiler_lock = threading.Lock()
+
+
+def make_profile_token() -> str:
+    """Подписанный токен для заголовка X-Profile-Token."""
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(
+        uuid.uuid4().hex)
+
+
+def valid_profile_token(token: str) -> bool:
+    try:
+        signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+            token, max_age=PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_reason(request) -> Optional[str]:
+    """Почему запрос нужно профилировать, или None."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token and valid_profile_token(token):
+        return 'token'
+    if (request.query_params.get(PROFILE_QUERY_PARAM)
+            and request.user.is_staff):
+        return 'staff'
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+class ProfileSession:
+    """
+    cProfile и tracemalloc вокруг обработки запроса. Результат
+    пишется в PROFILE_DIR: .prof в формате pstats (открывается snakeviz,
+    flameprof и gprof2dot) и .json с фазами и крупнейшими выделениями
+    памяти.
+    """
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        self.profiler = cProfile.Profile()
+        self.phases = {}
+        self.own_tracemalloc = not tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        if self.own_tracemalloc:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.started) * 1000, 3)
+        self.started = now
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        self.snapshot = tracemalloc.take_snapshot()
+        _, self.peak = tracemalloc.get_traced_memory()
+        if self.own_tracemalloc:
+            tracemalloc.stop()
+
+    def serializer_ms(self, stats: pstats.Stats) -> float:
+        """Самое долгое обращение к .data сериализаторов, мс."""
+        longest = 0.0
+        for (filename, _, name), row in stats.stats.items():
+            if name == 'data' and filename.endswith(SERIALIZER_MODULES):
+                longest = max(longest, row[3])
+        return round(longest * 1000, 3)
+
+    def save(self, request, view) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = '{}_{}_{}_{}'.format(
+            timezone.now().strftime('%Y%m%dT%H%M%S'),
+            getattr(view, 'basename', view.__class__.__name__),
+            getattr(view, 'action', None) or request.method.lower(),
+            uuid.uuid4().hex[:8])
+        path = os.path.join(PROFILE_DIR, name)
+        self.profiler.dump_stats(f'{path}.prof')
+        stats = pstats.Stats(self.profiler)
+        allocations = self.snapshot.filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        ).statistics('lineno')[:TOP_ALLOCATIONS]
+        with open(f'{path}.json', 'w') as file:
+            json.dump({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'user': request.user.pk,
+                'reason': self.reason,
+                'phases_ms': {**self.phases,
+                              'serializer': self.serializer_ms(stats)},
+                'peak_memory': self.peak,
+                'allocations': [
+                    {'where': str(stat.traceback), 'size': stat.size,
+                     'count': stat.count}
+                    for stat in allocations
+                ],
+            }, file, ensure_ascii=False, indent=2)
+        prune_profiles()
+        return path
+
+
+def prune_profiles(keep: int = PROFILE_RETENTION) -> int:
+    """Оставляет только keep последних профилей."""
+    profiles = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR)
+         if entry.name.endswith('.prof')),
+        key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in profiles[keep:]:
+        base = entry.path[:-len('.prof')]
+        for path in (entry.path, f'{base}.json'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return max(len(profiles) - keep, 0)
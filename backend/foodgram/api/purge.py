@@ -0,0 +1,153 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (FavoriteRecipe, Recipe, RecipeIngredient,
+                            ShoppingList)
+from users.models import AccountDeletion, CustomUser, Subscription
+from .pagination import invalidate_recipe_counts
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = getattr(settings, 'ACCOUNT_PURGE_BATCH_SIZE', 1000)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+
+
+def purge_steps(user_id: int):
+    """
+    Шаги удаления: (название, строки). Сначала чужие связи с рецептами
+    и подписки на автора, затем рецепты, затем собственные строки
+    пользователя. Удаление связей пишет в журнал log_link_deleted.
+    """
+    return (
+        ('favorites', FavoriteRecipe.objects.filter(
+            recipe__author_id=user_id)),
+        ('shopping_cart', ShoppingList.objects.filter(
+            recipe__author_id=user_id)),
+        ('subscribers', Subscription.objects.filter(author_id=user_id)),
+        ('ingredients', RecipeIngredient.objects.filter(
+            recipe__author_id=user_id)),
+        ('recipes', Recipe.objects.filter(author_id=user_id)),
+        ('own_favorites', FavoriteRecipe.objects.filter(user_id=user_id)),
+        ('own_shopping_cart', ShoppingList.objects.filter(user_id=user_id)),
+        ('subscriptions', Subscription.objects.filter(user_id=user_id)),
+    )
+
+
+def schedule_deletion(user: CustomUser) -> AccountDeletion:
+    """
+    Сразу скрывает аккаунт и его рецепты и отзывает токены; связанные
+    строки удаляются в фоне.
+    """
+    with transaction.atomic():
+        user.deleted_at = timezone.now()
+        user.is_active = False
+        user.save(update_fields=('deleted_at', 'is_active'))
+        Token.objects.filter(user=user).delete()
+        invalidate_recipe_counts()
+        deletion, _ = AccountDeletion.objects.get_or_create(
+            user=user, defaults={'email': user.email})
+        transaction.on_commit(
+            lambda: executor.submit(run_deletion, deletion.pk))
+    return deletion
+
+
+def claim_deletion(deletion_id=None) -> Optional[AccountDeletion]:
+    """Забирает ожидающее удаление; SKIP LOCKED - как у задач PDF."""
+    with transaction.atomic():
+        deletions = AccountDeletion.objects.select_for_update(
+            skip_locked=True).filter(status=AccountDeletion.PENDING)
+        if deletion_id is not None:
+            deletions = deletions.filter(pk=deletion_id)
+        deletion = deletions.first()
+        if deletion is None:
+            return None
+        deletion.status = AccountDeletion.RUNNING
+        deletion.started = timezone.now()
+        deletion.save(update_fields=('status', 'started', 'updated'))
+    return deletion
+
+
+def delete_batch(queryset, batch_size: int) -> int:
+    """Удаляет до batch_size строк в отдельной транзакции."""
+    ids = list(queryset.order_by('pk').values_list(
+        'pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    with transaction.atomic():
+        queryset.model.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def purge_account(deletion: AccountDeletion,
+                  batch_size: int = PURGE_BATCH_SIZE) -> None:
+    """
+    Удаляет данные аккаунта пачками и сохраняет прогресс после каждой.
+    Шаги повторяемы: после сбоя удаление продолжится с того же места.
+    """
+    user_id = deletion.user_id
+    if user_id is not None:
+        for stage, queryset in purge_steps(user_id):
+            deletion.stage = stage
+            while True:
+                deleted = delete_batch(queryset, batch_size)
+                if not deleted:
+                    break
+                deletion.deleted[stage] = (
+                    deletion.deleted.get(stage, 0) + deleted)
+                deletion.save(update_fields=('stage', 'deleted', 'updated'))
+        deletion.stage = 'user'
+        deletion.save(update_fields=('stage',))
+        CustomUser.objects.filter(pk=user_id).delete()
+    deletion.status = AccountDeletion.DONE
+    deletion.finished = timezone.now()
+    deletion.save(update_fields=('status', 'finished'))
+
+
+def run_deletion(deletion_id) -> None:
+    """Точка входа потока из пула."""
+    close_old_connections()
+    try:
+        deletion = claim_deletion(deletion_id)
+        if deletion is not None:
+            purge_account(deletion)
+    except Exception:
+        logger.exception('Удаление аккаунта %s прервано', deletion_id)
+    finally:
+        close_old_connections()
+
+
+def run_pending(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Обрабатывает очередь. Упавшее удаление остаётся в работе,
+    его вернёт в очередь requeue_stale; остальные продолжаются.
+    """
+    processed = 0
+    while True:
+        deletion = claim_deletion()
+        if deletion is None:
+            return processed
+        try:
+            purge_account(deletion, batch_size)
+        except Exception:
+            logger.exception('Удаление аккаунта %s прервано', deletion.pk)
+            continue
+        processed += 1
+
+
+def requeue_stale(seconds: int) -> int:
+    """
+    Возвращает в очередь удаления без новых пачек дольше seconds:
+    процесс, который их вёл, упал.
+    """
+    return AccountDeletion.objects.filter(
+        status=AccountDeletion.RUNNING,
+        updated__lt=timezone.now() - timedelta(seconds=seconds)
+    ).update(status=AccountDeletion.PENDING, started=None)
@@ -0,0 +1,27 @@
+import logging
+from typing import Optional
+
+from django.conf import settings
+
+QUERY_BUDGET_WARNINGS = getattr(settings, 'QUERY_BUDGET_WARNINGS',
+                                settings.DEBUG)
+QUERY_COUNT_HEADER = 'X-Query-Count'
+
+logger = logging.getLogger(__name__)
+
+
+def get_query_budget(view) -> Optional[int]:
+    """Предел запросов к базе для текущего действия представления."""
+    return getattr(view, 'query_budgets', {}).get(
+        getattr(view, 'action', None))
+
+
+def view_label(view) -> str:
+    return f'{view.basename}-{view.action}'
+
+
+def report_query_count(view, count: int) -> None:
+    budget = get_query_budget(view)
+    if budget is not None and count > budget:
+        logger.warning('%s: %d запросов к базе при бюджете %d',
+                       view_label(view), count, budget)
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import record_cache_lookup
+
+L1_SIZE = getattr(settings, 'REFERENCE_CACHE_L1_SIZE', 5000)
+L2_TTL = getattr(settings, 'REFERENCE_CACHE_TTL', 24 * 60 * 60)
+CHECK_INTERVAL = getattr(settings, 'REFERENCE_CACHE_CHECK_INTERVAL', 1.0)
+# Если с прошлой проверки сброшено больше объектов, L1 очищается целиком.
+MAX_FORGOTTEN = 100
+
+
+class ReferenceCache:
+    """
+    Небольшие часто читаемые объекты по id: LRU процесса (L1) поверх
+    общего кэша (L2). Ключи L2 содержат номер версии из общего кэша;
+    invalidate() увеличивает номер, и все процессы перестают читать
+    старые ключи. forget() сбрасывает отдельные объекты: удаляет их
+    ключи L2 и пишет id в общий журнал, по которому процессы убирают
+    их из L1. Номер и журнал перечитываются не чаще, чем раз
+    в CHECK_INTERVAL секунд, поэтому другой воркер может отдавать
+    прежние данные не дольше этого времени. Номер и журнал должны
+    быть в общем кэше (проверка api.E001): с LocMemCache каждый
+    процесс видит только свои сбросы.
+    Значения общие для всех запросов процесса: их нельзя изменять.
+    """
+
+    def __init__(self, namespace: str,
+                 loader: Callable[[Iterable[int]], Dict[int, dict]],
+                 maxsize: int = L1_SIZE,
+                 check_interval: float = CHECK_INTERVAL):
+        self.namespace = namespace
+        self.loader = loader
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.position = None
+        self.checked_at = 0.0
+
+    @property
+    def version_key(self) -> str:
+        return f'reference_version_{self.namespace}'
+
+    @property
+    def position_key(self) -> str:
+        return f'reference_forgotten_{self.namespace}'
+
+    def key(self, version: int, object_id: int) -> str:
+        return f'reference_{self.namespace}_{version}_{object_id}'
+
+    def forgotten_key(self, position: int) -> str:
+        return f'reference_forgotten_{self.namespace}_{position}'
+
+    def current_version(self) -> int:
+        now = time.monotonic()
+        with self.lock:
+            if (self.version is not None
+                    and now - self.checked_at < self.check_interval):
+                return self.version
+        shared = cache.get_many([self.version_key, self.position_key])
+        version = shared.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, 1, None)
+            version = cache.get(self.version_key, 1)
+        position = shared.get(self.position_key, 0)
+        forgotten = self.forgotten_since(position)
+        with self.lock:
+            if version != self.version or forgotten is None:
+                self.local.clear()
+                self.version = version
+            else:
+                for object_id in forgotten:
+                    self.local.pop(object_id, None)
+            self.position = position
+            self.checked_at = now
+        return version
+
+    def forgotten_since(self, position: int):
+        """
+        Id, сброшенные после прошлой проверки, или None, если их
+        слишком много или часть журнала уже вытеснена из кэша.
+        """
+        known = self.position
+        if known is None or known == position:
+            return ()
+        if not 0 < position - known <= MAX_FORGOTTEN:
+            return None
+        keys = [self.forgotten_key(number)
+                for number in range(known + 1, position + 1)]
+        entries = cache.get_many(keys)
+        if len(entries) < len(keys):
+            return None
+        return [object_id for ids in entries.values() for object_id in ids]
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, dict]:
+        """Объекты по id; отсутствующих в базе в ответе нет."""
+        ids = set(ids)
+        version = self.current_version()
+        found = {}
+        with self.lock:
+            for object_id in ids:
+                value = self.local.get(object_id)
+                if value is not None:
+                    self.local.move_to_end(object_id)
+                    found[object_id] = value
+        missing = ids - found.keys()
+        record_cache_lookup(f'{self.namespace}_l1', True, len(found))
+        if not missing:
+            return found
+        record_cache_lookup(f'{self.namespace}_l1', False, len(missing))
+        keys = {self.key(version, object_id): object_id
+                for object_id in missing}
+        shared = {keys[key]: value
+                  for key, value in cache.get_many(list(keys)).items()}
+        record_cache_lookup(f'{self.namespace}_l2', True, len(shared))
+        loaded = {}
+        if len(shared) < len(missing):
+            record_cache_lookup(f'{self.namespace}_l2', False,
+                                len(missing) - len(shared))
+            loaded = self.loader(missing - shared.keys())
+            self.store(version, loaded)
+        fetched = {**shared, **loaded}
+        self.remember(version, fetched)
+        found.update(fetched)
+        return found
+
+    def store(self, version: int, values: Dict[int, dict]) -> None:
+        if values:
+            cache.set_many({self.key(version, object_id): value
+                            for object_id, value in values.items()}, L2_TTL)
+
+    def remember(self, version: int, values: Dict[int, dict]) -> None:
+        with self.lock:
+            if version != self.version:
+                return
+            for object_id, value in values.items():
+                self.local[object_id] = value
+                self.local.move_to_end(object_id)
+            while len(self.local) > self.maxsize:
+                self.local.popitem(last=False)
+
+    def warm(self, ids: Iterable[int]) -> int:
+        """Загружает объекты из базы сразу в L2 и L1."""
+        version = self.current_version()
+        values = self.loader(ids)
+        self.store(version, values)
+        self.remember(version, values)
+        return len(values)
+
+    def invalidate(self) -> None:
+        """
+        Новая версия после фиксации транзакции: иначе другой процесс
+        успеет закэшировать под ней ещё не изменённые данные.
+        """
+        transaction.on_commit(self.bump)
+
+    def forget(self, ids: Iterable[int]) -> None:
+        """Сбрасывает отдельные объекты после фиксации транзакции."""
+        ids = list(ids)
+        transaction.on_commit(lambda: self.drop(ids))
+
+    def drop(self, ids) -> None:
+        try:
+            position = cache.incr(self.position_key)
+        except ValueError:
+            cache.add(self.position_key, 0, None)
+            position = cache.incr(self.position_key)
+        cache.set(self.forgotten_key(position), ids, L2_TTL)
+        version = self.current_version()
+        cache.delete_many([self.key(version, object_id)
+                           for object_id in ids])
+        with self.lock:
+            for object_id in ids:
+                self.local.pop(object_id, None)
+
+    def bump(self) -> None:
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 2, None)
+        with self.lock:
+            self.local.clear()
+            self.version = None
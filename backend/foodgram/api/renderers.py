@@ -0,0 +1,38 @@
+import json
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер, который дополнительно умеет отдавать массив по частям.
+    Байты совпадают с результатом обычного render() для того же списка.
+    """
+    items_per_chunk = 200
+
+    def can_stream(self, accepted_media_type, renderer_context):
+        return self.get_indent(accepted_media_type, renderer_context) is None
+
+    def encode_item(self, item):
+        ret = json.dumps(
+            item, cls=self.encoder_class,
+            ensure_ascii=self.ensure_ascii, allow_nan=not self.strict,
+            separators=SHORT_SEPARATORS if self.compact else LONG_SEPARATORS
+        )
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+    def render_stream(self, items):
+        """Генератор кусков JSON-массива из итератора элементов."""
+        separator = ',' if self.compact else ', '
+        yield b'['
+        leading = ''
+        chunk = []
+        for item in items:
+            chunk.append(self.encode_item(item))
+            if len(chunk) == self.items_per_chunk:
+                yield (leading + separator.join(chunk)).encode()
+                leading, chunk = separator, []
+        if chunk:
+            yield (leading + separator.join(chunk)).encode()
+        yield b']'
@@ -0,0 +1,187 @@
+from collections import defaultdict
+
+from django.db.models import Max
+from rest_framework import serializers
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingList, Tag)
+from users.models import CustomUser, Subscription
+from .fields import image_variant_urls
+from .reference_cache import ReferenceCache
+from .utils import request_cache
+
+AUTHOR_FIELDS = ('username', 'email', 'first_name', 'id', 'last_name', 'bio',
+                 'date_joined')
+RECIPE_COLUMNS = ('id', 'name', 'image', 'image_variants', 'text',
+                  'cooking_time', 'author_id', 'tag_ids')
+# Колонка и поле ответа, ради которого она нужна.
+OPTIONAL_COLUMNS = {'text': 'text', 'image_variants': 'image_variants',
+                    'tag_ids': 'tags'}
+
+datetime_field = serializers.DateTimeField()
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def load_tags(ids):
+    return {row['id']: {
+        'name': row['name'],
+        'color': row['color'],
+        'slug': row['slug'],
+        'id': row['id'],
+    } for row in Tag.objects.filter(id__in=ids).values(
+        'id', 'name', 'color', 'slug')}
+
+
+def load_ingredients(ids):
+    return {row['id']: {
+        'name': row['name'],
+        'measurement_unit': row['measurement_unit'],
+    } for row in Ingredient.objects.filter(id__in=ids).values(
+        'id', 'name', 'measurement_unit')}
+
+
+def load_authors(ids):
+    return {row['id']: {
+        'username': row['username'],
+        'email': row['email'],
+        'first_name': row['first_name'],
+        'id': row['id'],
+        'last_name': row['last_name'],
+        'bio': str(row['bio']),
+        'date_joined': datetime_field.to_representation(row['date_joined']),
+    } for row in CustomUser.objects.filter(id__in=ids).values(
+        *AUTHOR_FIELDS)}
+
+
+tag_cache = ReferenceCache('tags', load_tags)
+ingredient_cache = ReferenceCache('ingredients', load_ingredients)
+author_cache = ReferenceCache('authors', load_authors)
+WARM_AUTHORS = 1000
+
+
+def warm_reference_caches(authors: int = WARM_AUTHORS) -> dict:
+    """Все теги и ингредиенты и последние активные авторы."""
+    return {
+        'tags': tag_cache.warm(Tag.objects.values_list('id', flat=True)),
+        'ingredients': ingredient_cache.warm(
+            Ingredient.objects.values_list('id', flat=True)),
+        'authors': author_cache.warm(
+            Recipe.objects.order_by().values('author_id').annotate(
+                latest=Max('pub_date')).order_by('-latest').values_list(
+                'author_id', flat=True)[:authors]),
+    }
+
+
+class FastRecipeSerializer:
+    """
+    Представление рецептов только для чтения. Словари собираются
+    из строк values() и пакетных выборок связей без экземпляров
+    моделей и полей DRF; вывод совпадает с RecipeViewSerializer.
+    """
+
+    def __init__(self, rows, request, fields):
+        self.rows = rows
+        self.request = request
+        self.fields = fields
+
+    @staticmethod
+    def values(queryset, fields):
+        """Строки рецептов только с нужными для ответа колонками."""
+        columns = [column for column in RECIPE_COLUMNS
+                   if column not in OPTIONAL_COLUMNS
+                   or OPTIONAL_COLUMNS[column] in fields]
+        return queryset.prefetch_related(None).values(*columns)
+
+    @staticmethod
+    def row_from_instance(recipe):
+        """Строка из экземпляра; отложенные поля не дочитываются."""
+        deferred = recipe.get_deferred_fields()
+        row = {column: getattr(recipe, column) for column in RECIPE_COLUMNS
+               if column not in deferred}
+        if 'image' in row:
+            row['image'] = row['image'].name
+        return row
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        recipe_ids = [row['id'] for row in rows]
+        fields = self.fields
+        tags = self.get_tags(rows) if 'tags' in fields else {}
+        ingredients = (self.get_ingredients(recipe_ids)
+                       if 'ingredients' in fields else {})
+        authors = (self.get_authors({row['author_id'] for row in rows})
+                   if 'author' in fields else {})
+        favorited = (self.get_user_recipes(FavoriteRecipe, recipe_ids)
+                     if 'is_favorited' in fields else set())
+        in_cart = (self.get_user_recipes(ShoppingList, recipe_ids)
+                   if 'is_in_shopping_cart' in fields else set())
+        builders = {
+            'tags': lambda row: tags.get(row['id'], []),
+            'author': lambda row: authors[row['author_id']],
+            'ingredients': lambda row: ingredients.get(row['id'], []),
+            'is_favorited': lambda row: row['id'] in favorited,
+            'is_in_shopping_cart': lambda row: row['id'] in in_cart,
+            'name': lambda row: row['name'],
+            'image': lambda row: self.get_image_url(row['image']),
+            'image_variants': lambda row: image_variant_urls(
+                self.request, row['image'], row['image_variants']),
+            'text': lambda row: row['text'],
+            'cooking_time': lambda row: row['cooking_time'],
+            'id': lambda row: row['id'],
+        }
+        return [{name: builders[name](row) for name in fields}
+                for row in rows]
+
+    def get_image_url(self, name):
+        if not name:
+            return None
+        return self.request.build_absolute_uri(image_storage.url(name))
+
+    def get_tags(self, rows):
+        """Теги берутся по Recipe.tag_ids, без соединения таблиц."""
+        tags = tag_cache.get_many(
+            {tag_id for row in rows for tag_id in row['tag_ids']})
+        return {row['id']: [tags[tag_id] for tag_id in row['tag_ids']
+                            if tag_id in tags] for row in rows}
+
+    def get_ingredients(self, recipe_ids):
+        rows = list(RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values('recipe_id', 'ingredient_id', 'amount'))
+        known = ingredient_cache.get_many(
+            {row['ingredient_id'] for row in rows})
+        ingredients = defaultdict(list)
+        for row in rows:
+            ingredient = known.get(row['ingredient_id'])
+            if ingredient is None:
+                continue
+            ingredients[row['recipe_id']].append({
+                'name': ingredient['name'],
+                'measurement_unit': ingredient['measurement_unit'],
+                'amount': row['amount'],
+                'id': row['ingredient_id'],
+            })
+        return ingredients
+
+    def get_authors(self, author_ids):
+        user = self.request.user
+        subscribed = request_cache(self.request).get('subscribed_author_ids')
+        if subscribed is None:
+            subscribed = set()
+            if user.is_authenticated:
+                subscribed = set(Subscription.objects.filter(
+                    user=user, author_id__in=author_ids
+                ).values_list('author_id', flat=True))
+        return {author_id: {**author,
+                            'is_subscribed': author_id in subscribed}
+                for author_id, author
+                in author_cache.get_many(author_ids).items()}
+
+    def get_user_recipes(self, model, recipe_ids):
+        user = self.request.user
+        if not user.is_authenticated:
+            return set()
+        return set(model.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
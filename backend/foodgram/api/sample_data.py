@@ -0,0 +1,70 @@
+from typing import Optional
+
+from django.contrib.auth.hashers import make_password
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingList, Tag)
+from recipes.similarity import index_recipes
+from recipes.tagging import sync_tag_ids
+from users.models import CustomUser, Subscription
+
+BATCH_SIZE = 2000
+
+
+def seed_sample_data(authors: int, recipes_per_author: int = 3,
+                     tags: int = 3,
+                     reader_items: Optional[int] = None) -> CustomUser:
+    """
+    Заполняет пустую базу: authors авторов с рецептами, теги,
+    ингредиенты и читатель, подписанный на авторов и добавивший рецепты
+    в избранное и список покупок (первые reader_items, по умолчанию все).
+    Возвращает читателя.
+    """
+    password = make_password(None)
+    users = CustomUser.objects.bulk_create([
+        CustomUser(username=f'sample{number}',
+                   email=f'sample{number}@example.com', password=password)
+        for number in range(authors + 1)
+    ], batch_size=BATCH_SIZE)
+    reader, authors = users[0], users[1:]
+    tag_objects = Tag.objects.bulk_create([
+        Tag(name=f'sample{number}', slug=f'sample{number}',
+            color=f'#{number:06x}')
+        for number in range(tags)
+    ])
+    ingredients = Ingredient.objects.bulk_create([
+        Ingredient(name=f'sample{number}', measurement_unit='г')
+        for number in range(len(authors))
+    ], batch_size=BATCH_SIZE)
+    recipes = Recipe.objects.bulk_create([
+        Recipe(name=f'sample{author.pk}-{number}', text='text',
+               image='recipes/sample.png',
+               cooking_time=(author.pk * 7 + number * 13) % 180 + 1,
+               author=author)
+        for author in authors for number in range(recipes_per_author)
+    ], batch_size=BATCH_SIZE)
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag.pk)
+        for number, recipe in enumerate(recipes)
+        for tag in {tag_objects[number % tags],
+                    tag_objects[(number + 1) % tags]}
+    ], batch_size=BATCH_SIZE)
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(
+            recipe=recipe, amount=1,
+            ingredient=ingredients[(number + shift) % len(ingredients)])
+        for number, recipe in enumerate(recipes) for shift in range(3)
+    ], batch_size=BATCH_SIZE)
+    recipe_ids = [recipe.pk for recipe in recipes]
+    sync_tag_ids(recipe_ids)
+    index_recipes(recipe_ids)
+    Subscription.objects.bulk_create([
+        Subscription(user=reader, author=author)
+        for author in authors[:reader_items]
+    ], batch_size=BATCH_SIZE)
+    for model in (FavoriteRecipe, ShoppingList):
+        model.objects.bulk_create([
+            model(user=reader, recipe=recipe)
+            for recipe in recipes[:reader_items]
+        ], batch_size=BATCH_SIZE)
+    return reader
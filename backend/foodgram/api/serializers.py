@@ -1,13 +1,99 @@
+from contextlib import contextmanager
+
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from djoser.serializers import UserSerializer, UserCreateSerializer
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingList, Tag)
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ImageUpload,
+                            RecipeIngredient, ShoppingList, ShoppingListJob,
+                            Tag)
 from users.models import CustomUser, Subscription
-from .fields import Base64ImageField
-from .utils import bulk_create_ingredients
+from .fields import Base64ImageField, ImageVariantsField
+from .uploads import UPLOAD_MAX_SIZE, discard_upload, open_upload
+from .utils import (bulk_create_ingredients, insert_if_absent,
+                    subscribed_author_ids)
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+EXPAND_PARAM = 'expand'
+SUBSCRIPTION_AUTHOR_COLUMNS = ('id', 'email', 'username', 'first_name',
+                               'last_name')
+
+
+def split_query_param(request, name: str) -> set:
+    """Значения параметра запроса вида ?name=a,b,c."""
+    value = request.query_params.get(name, '')
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Отбор полей сериализатора по параметрам ?fields=, ?omit= и ?expand=.
+    Поля из expandable_fields разворачиваются во вложенные объекты
+    только по ?expand=.
+    """
+    expandable_fields = {}
+    nested_fields = ()
+
+    @classmethod
+    def get_sparse_fields(cls, request):
+        """Итоговый список полей и множество развёрнутых полей."""
+        fields = list(cls.Meta.fields)
+        expand = split_query_param(request, EXPAND_PARAM) & set(
+            cls.expandable_fields)
+        fields += [name for name in cls.expandable_fields
+                   if name in expand and name not in fields]
+        only = split_query_param(request, FIELDS_PARAM)
+        if only:
+            fields = [name for name in fields if name in only]
+        omit = split_query_param(request, OMIT_PARAM)
+        return [name for name in fields if name not in omit], expand
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        fields, expand = self.get_sparse_fields(request)
+        for name in expand.intersection(fields):
+            self.fields[name] = self.expandable_fields[name]()
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+
+def recipes_limit(request):
+    """Значение ?recipes_limit= или None, если ограничения нет."""
+    value = request.GET.get('recipes_limit')
+    return int(value) if value else None
+
+
+def attach_latest_recipes(subscriptions, limit=None) -> None:
+    """
+    Подгружает последние рецепты авторов подписок одним запросом
+    с row_number() по автору вместо запроса на каждую подписку.
+    """
+    authors = {subscription.author_id: subscription.author
+               for subscription in subscriptions}
+    for author in authors.values():
+        author.latest_recipes = []
+    if not authors:
+        return
+    recipes = Recipe.objects.raw(
+        'SELECT id, name, image, image_variants, cooking_time, author_id '
+        'FROM (SELECT id, name, image, image_variants, cooking_time, '
+        'author_id, row_number() OVER (PARTITION BY author_id '
+        'ORDER BY pub_date DESC) AS position '
+        'FROM recipes_recipe WHERE author_id = ANY(%s)) AS latest '
+        'WHERE %s IS NULL OR position <= %s '
+        'ORDER BY author_id, position',
+        [list(authors), limit, limit])
+    for recipe in recipes:
+        authors[recipe.author_id].latest_recipes.append(recipe)
 
 
 class UserRegistationSerializer(UserSerializer):
@@ -20,11 +106,14 @@ class UserRegistationSerializer(UserSerializer):
                   'last_name', 'bio', 'date_joined', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        """
+        Подписки текущего пользователя загружаются одним запросом
+        на весь запрос (и на весь пакет запросов).
+        """
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return Subscription.objects.filter(
-            user=user, author=obj.id).exists()
+        return obj.id in subscribed_author_ids(request)
 
 
 class UserCreationSerializer(UserCreateSerializer):
@@ -56,37 +145,45 @@ class SubscriptionListSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
+        if obj.user_id == request.user.id:
+            return True
         return Subscription.objects.filter(author=obj.author,
                                            user=request.user).exists()
 
-    def get_recipes_count(obj):
-        return obj.author.recipes.count()
+    def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.author.recipe_set.count()
 
     def get_recipes(self, data):
         request = self.context.get('request')
-        if request.GET.get('recipes_limit'):
-            limit = int(request.GET.get('recipes_limit'))
-            queryset = Recipe.objects.filter(
-                author=data.author)[:limit]
-        else:
-            queryset = Recipe.objects.filter(author=data.author)
-        serializer = TinyRecipeSerializer(queryset, read_only=True,
+        limit = recipes_limit(request)
+        recipes = getattr(data.author, 'latest_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=data.author)[:limit]
+        serializer = TinyRecipeSerializer(recipes, read_only=True,
                                           many=True)
         return serializer.data
 
+    @transaction.atomic
     def create(self, validated_data):
-        return Subscription.objects.create(**validated_data)
+        result = insert_if_absent(
+            Subscription, validated_data['user_id'], 'author',
+            validated_data['author_id'], SUBSCRIPTION_AUTHOR_COLUMNS, 'id')
+        if result is None:
+            raise NotFound('Пользователь не найден.')
+        inserted, author = result
+        if not inserted:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Вы уже подписаны на этого пользователя.']})
+        return Subscription(user_id=validated_data['user_id'],
+                            author=CustomUser(**author))
 
     def validate(self, data):
-        author = data['author_id']
-        user = data['user_id']
-        if user == author:
+        if data['user_id'] == data['author_id']:
             raise serializers.ValidationError(
                 'Оформление подписки на себя - недопустимо.')
-        if Subscription.objects.filter(user=user, author=author).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя.')
-
         return data
 
 
@@ -127,12 +224,13 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         many=True, source='ingredient_recipe')
     tags = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all())
-    image = Base64ImageField()
+    image = Base64ImageField(required=False)
+    image_upload = serializers.UUIDField(write_only=True, required=False)
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author', 'ingredients', 'name',
-                  'image', 'text', 'cooking_time', 'id')
+                  'image', 'image_upload', 'text', 'cooking_time', 'id')
         read_only_field = ('id', 'author')
         validators = [
             UniqueTogetherValidator(
@@ -155,25 +253,57 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     def create(self, obj):
         ingredients = obj.pop('ingredient_recipe')
-        created_recipe = super().create(obj)
-        bulk_create_ingredients(created_recipe, ingredients)
+        with self.upload_as_image(obj):
+            created_recipe = super().create(obj)
+            bulk_create_ingredients(created_recipe, ingredients)
 
         return created_recipe
 
+    @contextmanager
+    def upload_as_image(self, data):
+        """
+        Открывает загрузку как картинку рецепта на время сохранения
+        и закрывает файл при любом исходе; после фиксации транзакции
+        загрузка удаляется.
+        """
+        upload = data.pop('image_upload', None)
+        if upload is None:
+            yield
+            return
+        data['image'] = open_upload(upload)
+        try:
+            yield
+        finally:
+            data['image'].close()
+        transaction.on_commit(lambda: discard_upload(upload))
+
+    def validate_image_upload(self, value):
+        upload = ImageUpload.objects.filter(
+            pk=value, user=self.context['request'].user).first()
+        if upload is None or not upload.complete:
+            raise serializers.ValidationError(
+                'Загрузка не найдена или не завершена')
+        return upload
+
     def update(self, obj, validated_data):
-        obj.image = validated_data.get('image', obj.image)
-        obj.cooking_time = (
-            validated_data.get('cooking_time', obj.cooking_time)
-        )
-        obj.name = validated_data.get('name', obj.name)
-        obj.text = validated_data.get('text', obj.text)
-        obj.tags.set(validated_data.get('tags', obj.tags))
-        obj.ingredients.clear()
-        obj.save()
-
-        bulk_create_ingredients(obj,
-                                validated_data['ingredient_recipe'])
-        obj.save()
+        with self.upload_as_image(validated_data):
+            obj.image = validated_data.get('image', obj.image)
+            obj.cooking_time = (
+                validated_data.get('cooking_time', obj.cooking_time)
+            )
+            obj.name = validated_data.get('name', obj.name)
+            obj.text = validated_data.get('text', obj.text)
+            tags = validated_data.get('tags', obj.tags.all())
+            obj.tags.set(tags)
+            # tag_ids уже записан сигналом m2m_changed, save() ниже
+            # не должен вернуть прежнее значение.
+            obj.tag_ids = sorted({tag.id for tag in tags})
+            obj.ingredients.clear()
+            obj.save()
+
+            bulk_create_ingredients(obj,
+                                    validated_data['ingredient_recipe'])
+            obj.save()
 
         return obj
 
@@ -187,10 +317,14 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             else:
                 raise serializers.ValidationError(
                     'Ингредиенты не должны повторяться!')
+        if (self.instance is None and 'image' not in data
+                and 'image_upload' not in data):
+            raise serializers.ValidationError(
+                {'image': 'Нужна картинка или токен загрузки.'})
         return data
 
 
-class RecipeViewSerializer(serializers.ModelSerializer):
+class RecipeViewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериалиализатор просмотра рецептов."""
     author = UserRegistationSerializer(read_only=True)
     tags = TagSerializer(many=True)
@@ -198,15 +332,19 @@ class RecipeViewSerializer(serializers.ModelSerializer):
         read_only=True, many=True, source='ingredient_recipe')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
+    nested_fields = ('author', 'tags', 'ingredients')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time', 'id')
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time', 'id')
 
     def get_is_favorited(self, obj):
         """Проверка: добавлен ли рецепт в избранное."""
+        if hasattr(obj, 'in_favorites'):
+            return obj.in_favorites
         user = self.context['request'].user
         if user.is_authenticated:
             return FavoriteRecipe.objects.filter(
@@ -215,6 +353,8 @@ class RecipeViewSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка: добавлен ли рецепт в список покупок."""
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return ShoppingList.objects.filter(
@@ -222,8 +362,64 @@ class RecipeViewSerializer(serializers.ModelSerializer):
         return False
 
 
+class RecipeCardSerializer(RecipeViewSerializer):
+    """
+    Компактная карточка рецепта для списков: автор и теги отдаются
+    идентификаторами, ингредиенты и текст - только по ?expand=.
+    """
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+    tags = serializers.PrimaryKeyRelatedField(read_only=True, many=True)
+    nested_fields = ()
+    expandable_fields = {
+        'author': lambda: UserRegistationSerializer(read_only=True),
+        'tags': lambda: TagSerializer(many=True, read_only=True),
+        'ingredients': lambda: RecipeIngredientSerializer(
+            read_only=True, many=True, source='ingredient_recipe'),
+        'text': lambda: serializers.CharField(read_only=True),
+    }
+
+    class Meta(RecipeViewSerializer.Meta):
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time',
+                  'tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+
+
 class TinyRecipeSerializer(serializers.ModelSerializer):
     """Получение данных о рецептах для списка покупок и подписок."""
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class ShoppingListJobSerializer(serializers.ModelSerializer):
+    """Статус фоновой сборки списка покупок."""
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShoppingListJob
+        fields = ('id', 'status', 'file', 'created', 'finished')
+        read_only_fields = fields
+
+    def get_file(self, obj):
+        if obj.status != ShoppingListJob.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(reverse(
+            'recipe-shopping-list-job-file', kwargs={'job_id': obj.pk}))
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Загрузка картинки по частям; token передаётся в image_upload."""
+    token = serializers.UUIDField(source='id', read_only=True)
+    complete = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = ImageUpload
+        fields = ('token', 'size', 'offset', 'complete')
+        read_only_fields = ('offset',)
+
+    def validate_size(self, value):
+        if not 0 < value <= UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Размер файла должен быть от 1 до {UPLOAD_MAX_SIZE} байт')
+        return value
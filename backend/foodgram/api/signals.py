@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.db.models import IntegerField, Value
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from recipes.changes import CHANGE_KINDS, record_changes, record_removals
+from recipes.derivatives import schedule_variants
+from recipes.models import (Change, FavoriteRecipe, Ingredient, Recipe,
+                            ShoppingList, Tag)
+from recipes.tagging import recipes_with_tag, sync_tag_ids
+from users.models import CustomUser, Subscription
+
+from .pagination import invalidate_recipe_counts
+from .representations import (AUTHOR_FIELDS, author_cache, ingredient_cache,
+                              tag_cache)
+
+
+def release_file(field_file, name: str) -> None:
+    """Снимает ссылку на файл после фиксации транзакции."""
+    storage = field_file.storage
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, **kwargs):
+    invalidate_recipe_counts()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Обновляет Recipe.tag_ids затронутых рецептов."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        sync_tag_ids([instance.pk])
+    elif action == 'post_clear':
+        sync_tag_ids(list(recipes_with_tag(instance.pk)))
+    elif pk_set:
+        sync_tag_ids(pk_set)
+    invalidate_recipe_counts()
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    """Связи с тегом удаляются каскадом без m2m_changed."""
+    sync_tag_ids(list(recipes_with_tag(instance.pk)))
+    invalidate_recipe_counts()
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(sender, instance, **kwargs):
+    """
+    Запоминает прежнюю картинку и то, загружается ли новая: файл
+    ещё не записан, запись добавит на него ссылку. Варианты берутся
+    из базы, чтобы повторное сохранение не затёрло собранные в фоне
+    копии. Сравнивать имена здесь рано: у загрузки пока временное
+    имя, итоговое по хэшу появится при записи файла.
+    """
+    previous, variants = None, {}
+    if instance.pk:
+        previous, variants = Recipe.objects.filter(
+            pk=instance.pk).values_list(
+            'image', 'image_variants').first() or (None, {})
+    instance.previous_image = previous
+    instance.image_uploaded = bool(
+        instance.image) and not instance.image._committed
+    instance.image_variants = variants
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    """
+    Имя сравнивается после записи файла: у новой картинки прежние
+    варианты сбрасываются и собираются заново. Загрузка добавила
+    ссылку на файл, поэтому ссылка на прежний снимается, даже если
+    байты совпали и имя не изменилось.
+    """
+    previous = getattr(instance, 'previous_image', None)
+    if previous != instance.image.name:
+        if instance.image_variants:
+            instance.image_variants = {}
+            Recipe.objects.filter(pk=instance.pk).update(image_variants={})
+        if instance.image:
+            schedule_variants(instance.pk)
+    if previous and (previous != instance.image.name
+                     or getattr(instance, 'image_uploaded', False)):
+        release_file(instance.image, previous)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        release_file(instance.image, instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def log_recipe_saved(sender, instance, **kwargs):
+    record_changes(Change.RECIPE, Change.UPDATED, [instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def log_recipe_deleted(sender, instance, **kwargs):
+    """
+    Удаление рецепта пишется каждому, у кого он был: в избранном,
+    покупках или в подписке на автора. Сами связи, удалённые
+    каскадом, пишет log_link_deleted.
+    """
+    recipe_id = Value(instance.pk, output_field=IntegerField())
+    for holders in (
+            FavoriteRecipe.objects.filter(recipe=instance),
+            ShoppingList.objects.filter(recipe=instance),
+            Subscription.objects.filter(author_id=instance.author_id)):
+        record_removals(Change.RECIPE, holders.annotate(
+            removed_id=recipe_id), 'user_id', 'removed_id')
+
+
+def link_target(sender, instance) -> int:
+    return instance.author_id if sender is Subscription else (
+        instance.recipe_id)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Subscription)
+def log_link_created(sender, instance, created, **kwargs):
+    """Связи, созданные через ORM (например, в админке)."""
+    if created:
+        record_changes(CHANGE_KINDS[sender], Change.ADDED,
+                       [link_target(sender, instance)], instance.user_id)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Subscription)
+def log_link_deleted(sender, instance, **kwargs):
+    """
+    Любое удаление связи: из представлений, админки, каскадом
+    вместе с рецептом или автором и при удалении аккаунта.
+    """
+    record_changes(CHANGE_KINDS[sender], Change.REMOVED,
+                   [link_target(sender, instance)], instance.user_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_saved(sender, **kwargs):
+    tag_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_saved(sender, **kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def author_saved(sender, instance, created=False, update_fields=None,
+                 **kwargs):
+    """
+    Сбрасывается только профиль этого автора. Нового пользователя
+    в кэше ещё нет, сохранение только last_login при входе кэш
+    не сбрасывает.
+    """
+    if created or (update_fields
+                   and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    author_cache.forget([instance.pk])
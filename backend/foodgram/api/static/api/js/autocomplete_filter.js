@@ -0,0 +1,15 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(document).on('change', '.admin-autocomplete-filter select', function() {
+        const params = new URLSearchParams(window.location.search);
+        if (this.value) {
+            params.set(this.name, this.value);
+        } else {
+            params.delete(this.name);
+        }
+        params.delete('p');
+        window.location.search = params.toString();
+    });
+}
@@ -0,0 +1,136 @@
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from recipes.models import Change, FavoriteRecipe, Recipe, ShoppingList
+from users.models import Subscription
+
+from .serializers import TinyRecipeSerializer
+
+SYNC_RETENTION = getattr(settings, 'SYNC_CHANGES_RETENTION',
+                         30 * 24 * 60 * 60)
+SYNC_PAGE_SIZE = getattr(settings, 'SYNC_PAGE_SIZE', 500)
+SYNC_SALT = 'api.sync'
+SECTIONS = {
+    Change.FAVORITE: 'favorites',
+    Change.SHOPPING_CART: 'shopping_cart',
+    Change.SUBSCRIPTION: 'subscriptions',
+}
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = ('Курсор устарел или повреждён, '
+                      'загрузите списки заново')
+    default_code = 'cursor_expired'
+
+
+def make_cursor(position: Tuple[int, int]) -> str:
+    return signing.dumps(list(position), salt=SYNC_SALT)
+
+
+def read_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    Курсор - позиция (txid, id) в журнале. Он живёт не дольше срока
+    хранения журнала: всё, что записано после его выдачи, сжатие
+    ещё не удалило.
+    """
+    try:
+        txid, change_id = signing.loads(
+            cursor, salt=SYNC_SALT, max_age=SYNC_RETENTION)
+        return int(txid), int(change_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise CursorExpired()
+
+
+def snapshot_xmin() -> int:
+    """
+    Наименьший номер ещё не завершённой транзакции: все записи
+    журнала с меньшим txid уже зафиксированы или отменены.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+        return cursor.fetchone()[0]
+
+
+def visible_recipes(user) -> Q:
+    """Рецепты, которые есть у клиента: избранное, покупки, подписки."""
+    return (
+        Q(object_id__in=FavoriteRecipe.objects.filter(
+            user=user).values('recipe_id'))
+        | Q(object_id__in=ShoppingList.objects.filter(
+            user=user).values('recipe_id'))
+        | Q(object_id__in=Recipe.objects.filter(
+            author__in=Subscription.objects.filter(
+                user=user).values('author_id')).values('id'))
+    )
+
+
+def pending_changes(user, after: Tuple[int, int], limit: int) -> List[Change]:
+    """
+    Изменения пользователя и видимых ему рецептов после позиции after
+    в порядке (txid, id). Отдаются только записи транзакций старше
+    snapshot_xmin(): незавершённая транзакция могла взять меньший id,
+    и курсор её перепрыгнул бы.
+    """
+    txid, change_id = after
+    settled = Change.objects.filter(
+        Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id),
+        txid__lt=snapshot_xmin()
+    ).order_by('txid', 'id').only(
+        'id', 'txid', 'kind', 'action', 'object_id')
+    own = list(settled.filter(user=user)[:limit + 1])
+    recipes = list(settled.filter(
+        visible_recipes(user), user__isnull=True,
+        kind=Change.RECIPE)[:limit + 1])
+    return sorted(own + recipes,
+                  key=lambda change: (change.txid, change.id))[:limit + 1]
+
+
+def changes_since(request, cursor: Optional[str],
+                  limit: int = SYNC_PAGE_SIZE) -> dict:
+    """
+    Добавления и удаления в избранном, списке покупок и подписках
+    после курсора, по каждому объекту - последнее состояние. В recipes
+    - данные добавленных и изменённых рецептов, в removed_recipes - id
+    удалённых. Без курсора возвращает только текущий курсор: его берут
+    до полной загрузки списков.
+    """
+    if not cursor:
+        # Записи транзакций, не завершённых к этому моменту, идут после.
+        return {'cursor': make_cursor((snapshot_xmin(), 0)),
+                'has_more': False}
+    after = read_cursor(cursor)
+    changes = pending_changes(request.user, after, limit)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    latest = {}
+    for change in changes:
+        latest[change.kind, change.object_id] = change.action
+    result = {section: {Change.ADDED: [], Change.REMOVED: []}
+              for section in SECTIONS.values()}
+    recipe_ids = set()
+    removed_recipes = []
+    for (kind, object_id), action in latest.items():
+        if kind == Change.RECIPE:
+            if action == Change.REMOVED:
+                removed_recipes.append(object_id)
+            else:
+                recipe_ids.add(object_id)
+            continue
+        result[SECTIONS[kind]][action].append(object_id)
+        if kind != Change.SUBSCRIPTION and action == Change.ADDED:
+            recipe_ids.add(object_id)
+    result['recipes'] = TinyRecipeSerializer(
+        Recipe.objects.filter(id__in=recipe_ids).order_by('id'),
+        many=True, context={'request': request}).data
+    result['removed_recipes'] = removed_recipes
+    result['cursor'] = make_cursor(
+        (changes[-1].txid, changes[-1].id) if changes else after)
+    result['has_more'] = has_more
+    return result
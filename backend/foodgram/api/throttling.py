@@ -0,0 +1,159 @@
+import math
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import SimpleRateThrottle
+
+from .metrics import THROTTLED
+
+SYNC_INTERVAL = getattr(settings, 'THROTTLE_SYNC_INTERVAL', 1.0)
+
+
+class TokenBucket:
+    """Ведро токенов с равномерным пополнением."""
+    __slots__ = ('capacity', 'rate', 'tokens', 'stamp', 'pending')
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.stamp = now
+        self.pending = 0
+
+    def refill(self, now):
+        elapsed = max(now - self.stamp, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.stamp = now
+
+    def consume(self, now):
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.pending += 1
+        return True
+
+    def reset_after(self):
+        return math.ceil((self.capacity - self.tokens) / self.rate)
+
+    def wait(self):
+        return max((1 - self.tokens) / self.rate, 0)
+
+
+class BucketStore:
+    """
+    Вёдра текущего процесса. Проверка лимита не ходит в кэш: расход
+    накапливается локально и сводится с общим кэшем пачкой не чаще,
+    чем раз в SYNC_INTERVAL секунд.
+    """
+
+    def __init__(self, cache, sync_interval=SYNC_INTERVAL):
+        self.cache = cache
+        self.sync_interval = sync_interval
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.synced_at = 0.0
+
+    def consume(self, key, capacity, duration, now):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(capacity, capacity / duration, now)
+                self.buckets[key] = bucket
+            allowed = bucket.consume(now)
+            if now - self.synced_at >= self.sync_interval:
+                self.sync(now)
+            return allowed, bucket
+
+    def sync(self, now):
+        """Сводит локальный расход с общим состоянием всех процессов."""
+        self.synced_at = now
+        shared = self.cache.get_many(list(self.buckets))
+        updates = {}
+        timeout = 0
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if key in shared:
+                tokens, stamp = shared[key]
+                tokens = min(bucket.capacity,
+                             tokens + max(now - stamp, 0) * bucket.rate)
+                bucket.tokens = max(tokens - bucket.pending, 0)
+            if bucket.pending:
+                updates[key] = (bucket.tokens, now)
+                timeout = max(timeout, bucket.capacity / bucket.rate)
+                bucket.pending = 0
+            elif bucket.tokens >= bucket.capacity:
+                del self.buckets[key]
+        if updates:
+            self.cache.set_many(updates, timeout=math.ceil(timeout))
+
+
+bucket_store = BucketStore(cache)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Лимит на действие в виде ведра токенов. Область берётся из
+    throttle_scope представления, ставка - из DEFAULT_THROTTLE_RATES
+    по ключу '<scope>_<key_kind>'.
+    """
+    cache_format = 'throttle_tb_%(scope)s_%(ident)s'
+    key_kind = None
+    store = bucket_store
+
+    def __init__(self):
+        pass
+
+    def allow_request(self, request, view):
+        if getattr(view, 'throttle_scope', None) is None:
+            return True
+        self.scope = f'{view.throttle_scope}_{self.key_kind}'
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.bucket = self.store.consume(
+            self.key, self.num_requests, self.duration, self.timer())
+        self.add_headers(request)
+        if not allowed:
+            THROTTLED.inc(scope=self.scope)
+        return allowed
+
+    def add_headers(self, request):
+        """Запоминает самый строгий из лимитов для заголовков ответа."""
+        remaining = int(self.bucket.tokens)
+        current = getattr(request, 'rate_limit', None)
+        if current is None or remaining < current['RateLimit-Remaining']:
+            request.rate_limit = {
+                'RateLimit-Limit': self.num_requests,
+                'RateLimit-Remaining': remaining,
+                'RateLimit-Reset': self.bucket.reset_after(),
+            }
+
+    def wait(self):
+        return self.bucket.wait()
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    key_kind = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user.is_authenticated:
+            return None
+        return self.cache_format % {
+            'scope': self.scope, 'ident': request.user.pk}
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    key_kind = 'ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+WRITE_THROTTLES = [UserTokenBucketThrottle, IPTokenBucketThrottle]
@@ -0,0 +1,148 @@
+import os
+import re
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from recipes.models import ImageUpload
+
+UPLOAD_MAX_SIZE = getattr(settings, 'IMAGE_UPLOAD_MAX_SIZE',
+                          20 * 1024 * 1024)
+UPLOAD_CHUNK_MAX_SIZE = getattr(settings, 'IMAGE_UPLOAD_CHUNK_MAX_SIZE',
+                                4 * 1024 * 1024)
+UPLOAD_TEMP_DIR = getattr(settings, 'IMAGE_UPLOAD_TEMP_DIR', 'upload_tmp')
+UPLOAD_TTL = getattr(settings, 'IMAGE_UPLOAD_TTL', 24 * 60 * 60)
+READ_SIZE = 64 * 1024
+MULTIPART_OVERHEAD = 64 * 1024
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+PILLOW_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Файл слишком большой'
+    default_code = 'too_large'
+
+
+class UploadOffsetConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Часть файла не совпадает с уже полученными данными'
+    default_code = 'offset_conflict'
+
+
+class InvalidImage(ValidationError):
+    default_detail = 'Файл не является картинкой'
+
+
+def upload_path(upload: ImageUpload) -> str:
+    return os.path.join(UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Формат картинки по первым байтам файла."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def parse_content_range(header: Optional[str], upload: ImageUpload,
+                        length: int) -> Tuple[int, int]:
+    """Начало и длина части по заголовку Content-Range."""
+    if not header:
+        return upload.offset, length
+    match = CONTENT_RANGE.match(header)
+    if match is None:
+        raise ValidationError({'Content-Range': 'Неверный формат'})
+    start, end, total = map(int, match.groups())
+    if total != upload.size or end < start or end - start + 1 != length:
+        raise ValidationError({'Content-Range': 'Не совпадает с файлом'})
+    return start, length
+
+
+def write_chunk(upload: ImageUpload, stream, start: int, length: int,
+                max_length: int = UPLOAD_CHUNK_MAX_SIZE) -> None:
+    """
+    Дописывает часть файла во временный каталог, не держа её в памяти.
+    Тип проверяется по первым байтам, картинка целиком - по получении
+    последней части; при InvalidImage загрузку нужно удалить.
+    Файл целиком в одном запросе пишется с max_length=UPLOAD_MAX_SIZE.
+    """
+    if start != upload.offset:
+        raise UploadOffsetConflict(
+            f'Ожидается часть, начинающаяся с байта {upload.offset}')
+    if not 0 < length <= max_length or start + length > upload.size:
+        raise UploadTooLarge('Неверный размер части файла')
+    os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+    path = upload_path(upload)
+    remaining = length
+    with open(path, 'r+b' if start else 'wb') as file:
+        file.seek(start)
+        while remaining:
+            piece = stream.read(min(READ_SIZE, remaining))
+            if not piece:
+                break
+            if file.tell() == 0:
+                upload.format = sniff_format(piece) or ''
+                if not upload.format:
+                    raise InvalidImage('Недопустимый тип файла')
+            file.write(piece)
+            remaining -= len(piece)
+        file.truncate(start + length - remaining)
+    if remaining:
+        raise ValidationError('Часть файла получена не полностью')
+    upload.offset = start + length
+    if upload.complete:
+        verify_image(upload)
+    upload.save(update_fields=('offset', 'format'))
+
+
+def verify_image(upload: ImageUpload) -> None:
+    from PIL import Image
+
+    try:
+        with Image.open(upload_path(upload)) as image:
+            image_format = PILLOW_FORMATS.get(image.format)
+            image.verify()
+    except Exception:
+        image_format = None
+    if image_format != upload.format:
+        raise InvalidImage()
+
+
+def open_upload(upload: ImageUpload) -> File:
+    return File(open(upload_path(upload), 'rb'),
+                name=f'{upload.pk}.{upload.format}')
+
+
+def discard_upload(upload: ImageUpload) -> None:
+    try:
+        os.remove(upload_path(upload))
+    except FileNotFoundError:
+        pass
+    if upload.pk is not None:
+        ImageUpload.objects.filter(pk=upload.pk).delete()
+
+
+def purge_stale_uploads(seconds: int = UPLOAD_TTL) -> int:
+    """Удаляет загрузки, не использованные в рецепте за seconds секунд."""
+    stale = ImageUpload.objects.filter(
+        created__lt=timezone.now() - timedelta(seconds=seconds))
+    purged = 0
+    for upload in stale.iterator():
+        discard_upload(upload)
+        purged += 1
+    return purged
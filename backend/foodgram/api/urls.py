@@ -9,8 +9,11 @@ router_v1.register('ingredients', views.IngredientViewset,
                    basename='ingredient')
 router_v1.register('recipes', views.RecipeViewset, basename='recipe')
 router_v1.register('users', views.UserViewSet, basename='users')
+router_v1.register('uploads', views.ImageUploadViewset, basename='upload')
 
 urlpatterns = [
+    path('batch/', views.BatchView.as_view(viewsets=tuple(
+        viewset for _, viewset, _ in router_v1.registry)), name='batch'),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken'))
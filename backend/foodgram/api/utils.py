@@ -1,21 +1,54 @@
+import hashlib
 import io
-from typing import TextIO
+import json
+import mimetypes
+import time
+from functools import lru_cache
+from typing import Optional, Sequence, TextIO, Tuple
 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import UniqueConstraint
+from django.http import FileResponse, HttpResponse
 
-from recipes.models import RecipeIngredient, Recipe
+from recipes.changes import CHANGE_KINDS, record_changes
+from recipes.models import Change, RecipeIngredient, Recipe
+from recipes.similarity import update_recipe_signature
+from users.models import CustomUser, Subscription
+from .metrics import PDF_RENDER, record_cache_lookup
+
+SHOPPING_LIST_TITLE = 'Список покупок'
+DOCUMENT_VERSION = 1
+DOCUMENT_CACHE_TTL = getattr(settings, 'DOCUMENT_CACHE_TTL', 24 * 60 * 60)
+DOCUMENT_CACHE_MAX_SIZE = getattr(
+    settings, 'DOCUMENT_CACHE_MAX_SIZE', 1024 * 1024)
+MEDIA_ACCEL_REDIRECT = getattr(settings, 'MEDIA_ACCEL_REDIRECT', False)
+PROTECTED_MEDIA_URL = getattr(
+    settings, 'PROTECTED_MEDIA_URL', '/protected_media/')
+
+
+@lru_cache(maxsize=None)
+def register_fonts() -> None:
+    """Регистрирует шрифты ReportLab один раз, при первой сборке PDF."""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    pdfmetrics.registerFont(TTFont('Raleway Bold', './fonts/Raleway-Bold.ttf'))
+    pdfmetrics.registerFont(TTFont('Raleway', './fonts/Raleway-Regular.ttf'))
 
 
 def convert_pdf(data: list, title: str) -> TextIO:
-    """Конвертирует данные в pdf-файл при помощи ReportLab."""
+    """
+    Конвертирует данные в pdf-файл при помощи ReportLab. ReportLab
+    импортируется здесь, чтобы не замедлять запуск воркеров.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
 
+    register_fonts()
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
-    pdfmetrics.registerFont(TTFont('Raleway Bold', './fonts/Raleway-Bold.ttf'))
-    pdfmetrics.registerFont(TTFont('Raleway', './fonts/Raleway-Regular.ttf'))
 
     p.setFont('Raleway Bold', 18)
     height = 800
@@ -36,8 +69,161 @@ def convert_pdf(data: list, title: str) -> TextIO:
     return buffer
 
 
+def request_cache(request) -> dict:
+    """
+    Словарь на время запроса. У подзапросов пакетного запроса он общий,
+    поэтому одно и то же читается из базы один раз на весь пакет.
+    """
+    http_request = getattr(request, '_request', request)
+    if not hasattr(http_request, 'shared_cache'):
+        http_request.shared_cache = {}
+    return http_request.shared_cache
+
+
+def subscribed_author_ids(request) -> set:
+    """Все авторы, на которых подписан текущий пользователь."""
+    cache = request_cache(request)
+    if 'subscribed_author_ids' not in cache:
+        cache['subscribed_author_ids'] = set(
+            Subscription.objects.filter(user=request.user).values_list(
+                'author_id', flat=True))
+    return cache['subscribed_author_ids']
+
+
+def exclude_deleted_authors(queryset, author_field: str = 'author'):
+    """
+    Скрывает данные аккаунтов, ждущих удаления. Таких аккаунтов мало,
+    поэтому NOT IN по частичному индексу дешевле соединения с
+    таблицей пользователей.
+    """
+    return queryset.exclude(**{
+        f'{author_field}__in': CustomUser.objects.filter(
+            deleted_at__isnull=False).values('id')})
+
+
+def shopping_list_items(user_id: int):
+    """Ингредиенты всех рецептов из списка покупок пользователя."""
+    return exclude_deleted_authors(RecipeIngredient.objects.filter(
+        recipe__shopping_list__user_id=user_id), 'recipe__author').values_list(
+        'ingredient__name', 'ingredient__measurement_unit',
+        'amount'
+    )
+
+
+def shopping_list_ingredients(user_id: int) -> dict:
+    """Суммирует ингредиенты рецептов из списка покупок пользователя."""
+    ingredient_list = {}
+    for item in shopping_list_items(user_id):
+        name = item[0]
+        if name not in ingredient_list:
+            ingredient_list[name] = {
+                'measurement_unit': item[1],
+                'amount': item[2]
+            }
+        else:
+            ingredient_list[name]['amount'] += item[2]
+    return ingredient_list
+
+
+def document_digest(data: dict, title: str, output: str = 'pdf') -> str:
+    """Хэш содержимого документа: меняется вместе с любым изменением списка."""
+    payload = json.dumps([DOCUMENT_VERSION, output, title, data],
+                         ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_pdf(data: dict, title: str,
+               digest: Optional[str] = None) -> Tuple[str, bytes]:
+    """
+    PDF из кэша по хэшу содержимого; при промахе рендерится через
+    convert_pdf. Вытеснение старых документов - забота бэкенда кэша.
+    """
+    digest = digest or document_digest(data, title)
+    key = f'document_pdf_{digest}'
+    content = cache.get(key)
+    record_cache_lookup('document', content is not None)
+    if content is None:
+        started = time.perf_counter()
+        content = convert_pdf(data, title).getvalue()
+        PDF_RENDER.observe(time.perf_counter() - started)
+        if len(content) <= DOCUMENT_CACHE_MAX_SIZE:
+            cache.set(key, content, DOCUMENT_CACHE_TTL)
+    return digest, content
+
+
+def protected_file_response(field_file, filename: str) -> HttpResponse:
+    """
+    Отдаёт закрытый файл после проверки прав. За nginx тело отправляет
+    он сам по заголовку X-Accel-Redirect, иначе файл читает Django.
+    """
+    if not MEDIA_ACCEL_REDIRECT:
+        return FileResponse(field_file.open('rb'), as_attachment=True,
+                            filename=filename)
+    content_type, _ = mimetypes.guess_type(filename)
+    response = HttpResponse(
+        content_type=content_type or 'application/octet-stream')
+    response['X-Accel-Redirect'] = f'{PROTECTED_MEDIA_URL}{field_file.name}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 def bulk_create_ingredients(recipe: Recipe, ingredients: dict) -> None:
     RecipeIngredient.objects.bulk_create(
             [RecipeIngredient(ingredient_id=ingredient['ingredient']['id'],
                               amount=ingredient['amount'], recipe=recipe)
                 for ingredient in ingredients])
+    update_recipe_signature(recipe)
+
+
+def insert_if_absent(model, user_id: int, target_field: str, target_id: int,
+                     columns: Sequence[str] = (),
+                     author_field: Optional[str] = None
+                     ) -> Optional[Tuple[bool, dict]]:
+    """
+    Одним запросом добавляет связь пользователя с объектом через
+    INSERT ... ON CONFLICT ON CONSTRAINT ... DO NOTHING и читает колонки
+    этого объекта. Возвращает (добавлена ли связь, колонки объекта)
+    или None, если объекта нет. С author_field объекты аккаунтов,
+    ждущих удаления, считаются отсутствующими. Вставка идёт мимо
+    post_save, поэтому добавленная связь пишется в журнал здесь.
+    """
+    qn = connection.ops.quote_name
+    target = model._meta.get_field(target_field)
+    related = target.related_model._meta
+    constraint = next(
+        constraint.name for constraint in model._meta.constraints
+        if isinstance(constraint, UniqueConstraint)
+        and set(constraint.fields) == {'user', target_field}
+    )
+    targets = target.related_model.objects.filter(pk=target_id)
+    if author_field is not None:
+        targets = exclude_deleted_authors(targets, author_field)
+    target_sql, target_params = targets.values(
+        'pk').query.sql_with_params()
+    table, pk = qn(related.db_table), qn(related.pk.column)
+    selected = ''.join(
+        f', {qn(related.get_field(name).column)}' for name in columns)
+    sql = (
+        f'WITH target AS ({target_sql}), inserted AS ('
+        f'INSERT INTO {qn(model._meta.db_table)} '
+        f'({qn(model._meta.get_field("user").column)}, {qn(target.column)}) '
+        f'SELECT %s, {pk} FROM target '
+        f'ON CONFLICT ON CONSTRAINT {qn(constraint)} DO NOTHING RETURNING 1) '
+        f'SELECT EXISTS(SELECT 1 FROM inserted){selected} '
+        f'FROM {table} WHERE {pk} IN (SELECT {pk} FROM target)'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*target_params, user_id])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[0]:
+        record_changes(CHANGE_KINDS[model], Change.ADDED,
+                       [int(target_id)], user_id)
+    values = {}
+    for name, value in zip(columns, row[1:]):
+        field = related.get_field(name)
+        if hasattr(field, 'from_db_value'):
+            value = field.from_db_value(value, None, connection)
+        values[name] = value
+    return row[0], values
@@ -1,42 +1,132 @@
-from django.http import FileResponse
+import io
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from djoser.views import UserViewSet as DjoserUserViewSet
-from rest_framework import permissions, status, viewsets
+from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingList, Tag)
-from users.models import CustomUser, Subscription
+from recipes.models import (FavoriteRecipe, ImageUpload, Ingredient, Recipe,
+                            ShoppingList, ShoppingListJob, Tag)
+from recipes.similarity import similar_recipes
+from users.models import Subscription
+from .batch import BatchSerializer, run_sub_request
+from .facets import FACETS_CACHE_TTL, recipe_facets
 from .filters import CustomFilter, IngredientFilter
-from .pagination import RecipePagination
+from .idempotency import idempotent
+from .jobs import SYNC_LIMIT, enqueue_shopping_list
+from .metrics import record_cache_lookup
+from .mixins import (ProfilingMixin, QueryBudgetMixin,
+                     RateLimitHeadersMixin, StreamingListMixin)
+from .pagination import (RecipePagination, filter_cache_key,
+                         uses_user_filters)
 from .permissions import AuthorOrReadOnly
-from .serializers import (IngredientSerielizer,
-                          RecipeCreateSerializer, RecipeViewSerializer,
+from .purge import schedule_deletion
+from .renderers import StreamingJSONRenderer
+from .representations import FastRecipeSerializer
+from .serializers import (IngredientSerielizer, RecipeCardSerializer,
+                          ImageUploadSerializer, RecipeCreateSerializer,
+                          RecipeViewSerializer, ShoppingListJobSerializer,
                           SubscriptionListSerializer,
-                          TagSerializer, TinyRecipeSerializer)
-from .utils import convert_pdf
+                          TagSerializer, TinyRecipeSerializer,
+                          attach_latest_recipes, recipes_limit)
+from .sync import changes_since
+from .throttling import WRITE_THROTTLES
+from .uploads import (MULTIPART_OVERHEAD, UPLOAD_MAX_SIZE, InvalidImage,
+                      UploadTooLarge, discard_upload, parse_content_range,
+                      write_chunk)
+from .utils import (SHOPPING_LIST_TITLE, cached_pdf, document_digest,
+                    exclude_deleted_authors, insert_if_absent,
+                    protected_file_response, shopping_list_ingredients)
+
+CARD_VIEW = 'card'
+USER_FLAGS = {
+    'is_favorited': ('in_favorites', FavoriteRecipe),
+    'is_in_shopping_cart': ('in_shopping_cart', ShoppingList),
+}
+TINY_RECIPE_COLUMNS = ('id', 'name', 'image', 'image_variants',
+                       'cooking_time')
+SIMILAR_DEFAULT_LIMIT = 6
+SIMILAR_MAX_LIMIT = 50
+JOB_ID_PATTERN = (r'(?P<job_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                  r'[0-9a-f]{4}-[0-9a-f]{12})')
+
+
+def annotate_user_flags(queryset, user, fields):
+    """Избранное и список покупок - подзапросами в той же выборке."""
+    if not user.is_authenticated:
+        return queryset
+    for field, (name, model) in USER_FLAGS.items():
+        if field in fields:
+            queryset = queryset.annotate(**{name: Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')))})
+    return queryset
 
 
-class UserViewSet(DjoserUserViewSet):
+def subscription_queryset(user):
+    """Подписки пользователя с числом рецептов автора."""
+    return exclude_deleted_authors(
+        Subscription.objects.filter(user=user)).select_related(
+        'author').annotate(
+        recipes_count=Count('author__recipe')).order_by('id')
+
+
+class UserViewSet(QueryBudgetMixin, ProfilingMixin, RateLimitHeadersMixin,
+                  DjoserUserViewSet):
     """CRUD user models."""
     pagination_class = RecipePagination
+    throttle_scope = None
+    query_budgets = {'list': 5, 'retrieve': 3, 'me': 2, 'subscriptions': 5,
+                     'changes': 4}
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+    def perform_destroy(self, instance):
+        """Аккаунт скрывается сразу, его данные удаляются в фоне."""
+        schedule_deletion(instance)
 
     @action(detail=False,
             methods=['GET'],
             permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
-        serializer = SubscriptionListSerializer(self.paginate_queryset(
-            Subscription.objects.filter(user=request.user)), many=True,
-            context={'request': request})
+        page = self.paginate_queryset(subscription_queryset(request.user))
+        attach_latest_recipes(page, recipes_limit(request))
+        serializer = SubscriptionListSerializer(
+            page, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
 
+    @action(detail=False,
+            methods=['GET'],
+            url_path='me/changes',
+            permission_classes=[permissions.IsAuthenticated])
+    def changes(self, request):
+        """
+        Изменения избранного, списка покупок, подписок и рецептов
+        после курсора ?cursor=; при has_more запрос повторяют с новым.
+        """
+        return Response(changes_since(
+            request, request.query_params.get('cursor')))
+
     @action(
         detail=True,
         methods=['POST', 'DELETE'],
         permission_classes=[permissions.IsAuthenticated],
+        throttle_classes=WRITE_THROTTLES,
+        throttle_scope='subscribe',
     )
+    @idempotent
     def subscribe(self, request, id=None):
         if request.method == 'POST':
             request.data['user_id'] = request.user.id
@@ -48,32 +138,39 @@ class UserViewSet(DjoserUserViewSet):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            current_subscription = get_object_or_404(
-                Subscription, author=get_object_or_404(CustomUser, id=id),
-                user=request.user)
-            self.perform_destroy(current_subscription)
+            with transaction.atomic():
+                deleted, _ = Subscription.objects.filter(
+                    author_id=id, user=request.user).delete()
+                if not deleted:
+                    raise Http404
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewset(viewsets.ModelViewSet):
+class IngredientViewset(QueryBudgetMixin, StreamingListMixin,
+                        viewsets.ModelViewSet):
     """Отдельные ингредиенты и их список."""
+    query_budgets = {'list': 2, 'retrieve': 2}
     serializer_class = IngredientSerielizer
     permission_classes = [permissions.AllowAny]
     queryset = Ingredient.objects.all()
     pagination_class = None
+    renderer_classes = (StreamingJSONRenderer, BrowsableAPIRenderer)
     filter_backends = (IngredientFilter, )
     search_fields = ('^name', )
 
 
-class TagViewset(viewsets.ModelViewSet):
+class TagViewset(QueryBudgetMixin, StreamingListMixin, viewsets.ModelViewSet):
     """Отдельные тэги и их список."""
+    query_budgets = {'list': 2, 'retrieve': 2}
     serializer_class = TagSerializer
     permission_classes = [permissions.AllowAny]
     queryset = Tag.objects.all()
     pagination_class = None
+    renderer_classes = (StreamingJSONRenderer, BrowsableAPIRenderer)
 
 
-class RecipeViewset(viewsets.ModelViewSet):
+class RecipeViewset(QueryBudgetMixin, ProfilingMixin, RateLimitHeadersMixin,
+                    viewsets.ModelViewSet):
     """
     Обработка запросов о рецептах, просмотр, создание,
     изменение, удаление.
@@ -82,9 +179,15 @@ class RecipeViewset(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend, )
     filterset_class = CustomFilter
     pagination_class = RecipePagination
+    fast_serialization = True
+    cache_counts = True
+    throttle_scope = None
+    query_budgets = {'list': 10, 'retrieve': 8, 'facets': 4, 'similar': 6,
+                     'favorite_recipe': 4, 'shopping_list': 4,
+                     'download_shopping_cart': 3}
 
     def get_permissions(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'facets', 'similar'):
             permission_classes = [permissions.AllowAny]
         elif self.action in ('update', 'destroy', 'partial_update'):
             permission_classes = [AuthorOrReadOnly]
@@ -92,29 +195,88 @@ class RecipeViewset(viewsets.ModelViewSet):
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    def get_throttles(self):
+        if self.action == 'create':
+            self.throttle_scope = 'recipe_create'
+            return [throttle() for throttle in WRITE_THROTTLES]
+        return super().get_throttles()
+
     def get_serializer_class(self):
         if self.request.method == 'POST' or self.request.method == 'PATCH':
             return RecipeCreateSerializer
+        if self.request.query_params.get('view') == CARD_VIEW:
+            return RecipeCardSerializer
         return RecipeViewSerializer
 
+    def get_queryset(self):
+        """Подгружает только те поля и связи, что попадут в ответ."""
+        queryset = exclude_deleted_authors(Recipe.objects.all())
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        serializer_class = self.get_serializer_class()
+        fields, expand = serializer_class.get_sparse_fields(self.request)
+        nested = expand.union(serializer_class.nested_fields)
+        if 'text' not in fields:
+            queryset = queryset.defer('text')
+        if self.use_fast_serialization():
+            return queryset
+        if 'author' in fields and 'author' in nested:
+            queryset = queryset.select_related('author')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related('tags')
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(
+                'ingredient_recipe__ingredient')
+        return annotate_user_flags(queryset, self.request.user, fields)
+
+    def use_fast_serialization(self):
+        return (self.fast_serialization
+                and self.get_serializer_class() is RecipeViewSerializer)
+
+    def get_fast_serializer(self, rows):
+        fields, _ = RecipeViewSerializer.get_sparse_fields(self.request)
+        return FastRecipeSerializer(rows, self.request, fields)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_serialization():
+            return super().list(request, *args, **kwargs)
+        fields, _ = RecipeViewSerializer.get_sparse_fields(request)
+        rows = FastRecipeSerializer.values(
+            self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                self.get_fast_serializer(page).data)
+        return Response(self.get_fast_serializer(rows).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_serialization():
+            return super().retrieve(request, *args, **kwargs)
+        row = FastRecipeSerializer.row_from_instance(self.get_object())
+        return Response(self.get_fast_serializer([row]).data[0])
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def new_recipe(self, model, request, pk):
-        user = self.request.user
-        current_recipe = get_object_or_404(Recipe, pk=pk)
-        if model.objects.filter(recipe=current_recipe, user=user).exists():
+        with transaction.atomic():
+            result = insert_if_absent(model, request.user.id, 'recipe', pk,
+                                      TINY_RECIPE_COLUMNS, 'author')
+            if result is None:
+                raise Http404
+            inserted, columns = result
+        if not inserted:
             return Response(
                 'Рецепт уже добавлен', status=status.HTTP_400_BAD_REQUEST)
-        model.objects.create(recipe=current_recipe, user=user)
-        serializer = TinyRecipeSerializer(current_recipe)
+        serializer = TinyRecipeSerializer(Recipe(**columns))
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     def remove_recipe(self, model, request, pk):
-        user = self.request.user
-        current_recipe = get_object_or_404(Recipe, pk=pk)
-        obj = get_object_or_404(model, recipe=current_recipe, user=user)
-        obj.delete()
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                recipe_id=pk, user=request.user).delete()
+            if not deleted:
+                raise Http404
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -122,7 +284,10 @@ class RecipeViewset(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated],
         methods=['post', 'delete'],
         url_path='shopping_cart',
+        throttle_classes=WRITE_THROTTLES,
+        throttle_scope='shopping_cart',
     )
+    @idempotent
     def shopping_list(self, request, pk):
         if request.method == 'POST':
             return self.new_recipe(ShoppingList, request, pk)
@@ -134,41 +299,218 @@ class RecipeViewset(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated],
         methods=['post', 'delete'],
         url_path='favorite',
+        throttle_classes=WRITE_THROTTLES,
+        throttle_scope='favorite',
     )
+    @idempotent
     def favorite_recipe(self, request, pk=None):
         if request.method == 'POST':
             return self.new_recipe(FavoriteRecipe, request, pk)
         else:
             return self.remove_recipe(FavoriteRecipe, request, pk)
 
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request):
+        """
+        Количества рецептов по тегам, авторам и времени приготовления
+        для тех же фильтров, что и у списка.
+        """
+        cache_key = None
+        if not uses_user_filters(request):
+            cache_key = filter_cache_key('recipe_facets', request, self)
+            data = cache.get(cache_key)
+            record_cache_lookup('recipe_facets', data is not None)
+            if data is not None:
+                return Response(data)
+        filterset = DjangoFilterBackend().get_filterset(
+            request, self.get_queryset(), self)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        data = recipe_facets(filterset)
+        if cache_key is not None:
+            cache.set(cache_key, data, FACETS_CACHE_TTL)
+        return Response(data)
+
+    @action(
+        detail=True,
+        permission_classes=[permissions.AllowAny],
+        methods=['get', ],
+        url_path='similar',
+    )
+    def similar(self, request, pk=None):
+        """Похожие рецепты по ингредиентам и тегам из LSH-индекса."""
+        current_recipe = get_object_or_404(self.get_queryset(), pk=pk)
+        try:
+            limit = int(request.query_params.get(
+                'limit', SIMILAR_DEFAULT_LIMIT))
+            limit = max(1, min(limit, SIMILAR_MAX_LIMIT))
+        except ValueError:
+            limit = SIMILAR_DEFAULT_LIMIT
+        ranked = similar_recipes(current_recipe, limit)
+        recipes = self.get_queryset().in_bulk([pk for pk, _ in ranked])
+        serializer = TinyRecipeSerializer(
+            [recipes[pk] for pk, _ in ranked if pk in recipes],
+            many=True, context={'request': request})
+        return Response(serializer.data)
+
     @action(
         detail=False,
         permission_classes=[permissions.IsAuthenticated],
-        methods=['get', ],
+        methods=['get', 'post'],
         url_path='download_shopping_cart'
     )
     def download_shopping_cart(self, request):
-        ingredient_list = {}
-        list = RecipeIngredient.objects.filter(
-            recipe__shopping_list__user=request.user).values_list(
-            'ingredient__name', 'ingredient__measurement_unit',
-            'amount'
-        )
-        for item in list:
-            name = item[0]
-            if name not in ingredient_list:
-                ingredient_list[name] = {
-                    'measurement_unit': item[1],
-                    'amount': item[2]
-                }
-            else:
-                ingredient_list[name]['amount'] += item[2]
-
-        file = convert_pdf(ingredient_list, 'Список покупок')
-
-        return FileResponse(
-            file,
-            as_attachment=True,
-            filename='shopping_list.pdf',
-            status=status.HTTP_200_OK
-        )
+        """
+        Небольшой список покупок отдаётся сразу. POST и большие списки
+        ставятся в очередь: ответ 202 со ссылкой на статус задачи.
+        """
+        if (request.method == 'GET' and ShoppingList.objects.filter(
+                user=request.user).count() <= SYNC_LIMIT):
+            ingredients = shopping_list_ingredients(request.user.id)
+            digest = document_digest(ingredients, SHOPPING_LIST_TITLE)
+            etag = quote_etag(digest)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                _, content = cached_pdf(
+                    ingredients, SHOPPING_LIST_TITLE, digest)
+                response = FileResponse(
+                    io.BytesIO(content),
+                    as_attachment=True,
+                    filename='shopping_list.pdf',
+                    status=status.HTTP_200_OK
+                )
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        job = enqueue_shopping_list(request.user)
+        return self.shopping_list_job_response(
+            request, job, status.HTTP_202_ACCEPTED)
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        methods=['get', ],
+        url_path=f'download_shopping_cart/{JOB_ID_PATTERN}'
+    )
+    def shopping_list_job(self, request, job_id=None):
+        job = get_object_or_404(ShoppingListJob, pk=job_id, user=request.user)
+        return self.shopping_list_job_response(request, job)
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        methods=['get', ],
+        url_path=f'download_shopping_cart/{JOB_ID_PATTERN}/file'
+    )
+    def shopping_list_job_file(self, request, job_id=None):
+        job = get_object_or_404(ShoppingListJob, pk=job_id, user=request.user,
+                                status=ShoppingListJob.DONE)
+        return protected_file_response(job.file, 'shopping_list.pdf')
+
+    def shopping_list_job_response(self, request, job,
+                                   status_code=status.HTTP_200_OK):
+        serializer = ShoppingListJobSerializer(
+            job, context={'request': request})
+        location = request.build_absolute_uri(
+            reverse('recipe-shopping-list-job', kwargs={'job_id': job.pk}))
+        return Response(serializer.data, status=status_code,
+                        headers={'Location': location})
+
+
+class ImageUploadViewset(RateLimitHeadersMixin,
+                         mixins.RetrieveModelMixin,
+                         viewsets.GenericViewSet):
+    """
+    Загрузка картинки рецепта без base64. POST с файлом в поле file
+    загружает её целиком, POST с size открывает загрузку по частям,
+    которые дописываются PUT-запросами с заголовком Content-Range.
+    """
+    serializer_class = ImageUploadSerializer
+    throttle_classes = WRITE_THROTTLES
+    throttle_scope = 'upload'
+    http_method_names = ['get', 'post', 'put', 'delete']
+
+    def get_queryset(self):
+        return ImageUpload.objects.filter(user=self.request.user)
+
+    def get_throttles(self):
+        if self.request.method in ('GET', 'DELETE'):
+            return []
+        return super().get_throttles()
+
+    def create(self, request):
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if length > UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD:
+            raise UploadTooLarge()
+        file = request.FILES.get('file')
+        if file is None:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            upload = serializer.save(user=request.user)
+        else:
+            upload = self.write_file(request.user, file)
+        return Response(self.get_serializer(upload).data,
+                        status=status.HTTP_201_CREATED)
+
+    def update(self, request, pk=None):
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        upload = self.write(
+            get_object_or_404(self.get_queryset(), pk=pk),
+            lambda upload: write_chunk(
+                upload, request.stream,
+                *parse_content_range(request.headers.get('Content-Range'),
+                                     upload, length)))
+        return Response(self.get_serializer(upload).data)
+
+    def destroy(self, request, pk=None):
+        discard_upload(get_object_or_404(self.get_queryset(), pk=pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def write_file(self, user, file):
+        """
+        Файл целиком: строка загрузки создаётся в одной транзакции
+        с записью, при любой ошибке не остаётся ни строки, ни файла.
+        """
+        if not file.size or file.size > UPLOAD_MAX_SIZE:
+            raise UploadTooLarge()
+        upload = ImageUpload(user=user, size=file.size)
+        try:
+            with transaction.atomic():
+                upload.save()
+                write_chunk(upload, file, 0, file.size, UPLOAD_MAX_SIZE)
+        except Exception:
+            discard_upload(upload)
+            raise
+        return upload
+
+    def write(self, upload, writer):
+        """Пишет часть под блокировкой строки; битую картинку удаляет."""
+        try:
+            with transaction.atomic():
+                locked = ImageUpload.objects.select_for_update().get(
+                    pk=upload.pk)
+                writer(locked)
+        except InvalidImage:
+            discard_upload(upload)
+            raise
+        return locked
+
+
+class BatchView(APIView):
+    """
+    Несколько GET-запросов к маршрутам API одним POST-запросом:
+    {"requests": ["/api/users/me/", "/api/recipes/?limit=6"]}.
+    Подзапросы выполняются по очереди в этом же процессе с общей
+    аутентификацией; права, лимиты и ошибки у каждого свои,
+    как при отдельном запросе.
+    """
+    permission_classes = [permissions.AllowAny]
+    viewsets = ()
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'responses': [
+            run_sub_request(request, path, self.viewsets)
+            for path in serializer.validated_data['requests']
+        ]})
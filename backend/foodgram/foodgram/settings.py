@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from pathlib import Path
 
@@ -22,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -32,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -111,9 +114,85 @@ STATIC_ROOT = os.path.join(BASE_DIR, "backend_static")
 
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'backend_media')
+PROTECTED_MEDIA_URL = '/protected_media/'
+MEDIA_ACCEL_REDIRECT = os.getenv('MEDIA_ACCEL_REDIRECT',
+                                 default='False') == 'True'
+MEDIA_GC_GRACE = int(os.getenv('MEDIA_GC_GRACE', default=60 * 60))
+IMAGE_UPLOAD_TEMP_DIR = os.getenv('IMAGE_UPLOAD_TEMP_DIR',
+                                  default=os.path.join(BASE_DIR, 'upload_tmp'))
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE',
+                                      default=20 * 1024 * 1024))
+IMAGE_UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_CHUNK_MAX_SIZE',
+                                            default=4 * 1024 * 1024))
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS',
+                                         default=2))
+IMAGE_DERIVATIVE_FORMATS = tuple(os.getenv(
+    'IMAGE_DERIVATIVE_FORMATS', default='webp').split(','))
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+# Число воркеров gunicorn (он читает ту же переменную): с несколькими
+# воркерами кэш должен быть общим, см. api/checks.py.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', default=1))
+
+THROTTLE_SYNC_INTERVAL = float(os.getenv('THROTTLE_SYNC_INTERVAL',
+                                         default=1.0))
+
+ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ESTIMATED_COUNT_THRESHOLD',
+                                          default=100000))
+
+RECIPE_EXACT_COUNT_LIMIT = int(os.getenv('RECIPE_EXACT_COUNT_LIMIT',
+                                         default=1000))
+RECIPE_COUNT_CACHE_TTL = int(os.getenv('RECIPE_COUNT_CACHE_TTL',
+                                       default=5 * 60))
+
+SHOPPING_LIST_JOB_WORKERS = int(os.getenv('SHOPPING_LIST_JOB_WORKERS',
+                                          default=2))
+SHOPPING_LIST_SYNC_LIMIT = int(os.getenv('SHOPPING_LIST_SYNC_LIMIT',
+                                         default=20))
+DOCUMENT_CACHE_TTL = int(os.getenv('DOCUMENT_CACHE_TTL', default=24 * 60 * 60))
+DOCUMENT_CACHE_MAX_SIZE = int(os.getenv('DOCUMENT_CACHE_MAX_SIZE',
+                                        default=1024 * 1024))
+
+BOOT_TIME_BUDGET_MS = int(os.getenv('BOOT_TIME_BUDGET_MS', default=1500))
+
+METRICS_DIR = os.getenv('METRICS_DIR',
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'foodgram_metrics'))
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', default='False') == 'True'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', default=0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', default=os.path.join(BASE_DIR,
+                                                            'profiles'))
+PROFILE_RETENTION = int(os.getenv('PROFILE_RETENTION', default=50))
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', default=15 * 60))
+
+REFERENCE_CACHE_L1_SIZE = int(os.getenv('REFERENCE_CACHE_L1_SIZE',
+                                        default=5000))
+REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL',
+                                    default=24 * 60 * 60))
+REFERENCE_CACHE_CHECK_INTERVAL = float(os.getenv(
+    'REFERENCE_CACHE_CHECK_INTERVAL', default=1.0))
+
+ACCOUNT_PURGE_BATCH_SIZE = int(os.getenv('ACCOUNT_PURGE_BATCH_SIZE',
+                                         default=1000))
+
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', default=10))
+
+SYNC_CHANGES_RETENTION = int(os.getenv('SYNC_CHANGES_RETENTION',
+                                       default=30 * 24 * 60 * 60))
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', default=500))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -127,6 +206,18 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.'
                                 'PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_THROTTLE_RATES': {
+        'subscribe_user': '30/min',
+        'subscribe_ip': '120/min',
+        'favorite_user': '60/min',
+        'favorite_ip': '240/min',
+        'shopping_cart_user': '60/min',
+        'shopping_cart_ip': '240/min',
+        'recipe_create_user': '10/min',
+        'recipe_create_ip': '30/min',
+        'upload_user': '120/min',
+        'upload_ip': '300/min',
+    },
 }
 
 DJOSER = {
@@ -1,7 +1,16 @@
 import os
 
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# gunicorn не запускает системные проверки, а с кэшем в памяти
+# процесса воркеры не видят лимиты и версии друг друга.
+errors = [error for error in checks.run_checks(tags=[checks.Tags.caches])
+          if error.is_serious()]
+if errors:
+    raise ImproperlyConfigured('\n'.join(str(error) for error in errors))
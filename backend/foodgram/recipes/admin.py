@@ -1,18 +1,33 @@
 from django.contrib import admin
 
+from api.admin import (AutocompleteFilter, AutocompleteFilterMixin,
+                       related_count)
+from api.pagination import EstimatedCountPaginator
 from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingList, Tag)
+                            RecipeIngredient, ShoppingList, ShoppingListJob,
+                            Tag)
 
 
-class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'measurement_unit')
-    list_filter = ('name', 'measurement_unit')
-    search_fields = ('name', 'measurement_unit')
+class AuthorFilter(AutocompleteFilter):
+    title = 'Автор'
+    field_name = 'author'
+
+
+class RecipeFilter(AutocompleteFilter):
+    title = 'Рецепт'
+    field_name = 'recipe'
 
 
-class IngredientInline(admin.TabularInline):
-    model = Ingredient
-    fields = ('name', 'measurement_unit')
+class UserFilter(AutocompleteFilter):
+    title = 'Пользователь'
+    field_name = 'user'
+
+
+class IngredientAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'measurement_unit')
+    search_fields = ('^name',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -21,15 +36,14 @@ class TagAdmin(admin.ModelAdmin):
     search_fields = ('slug', 'name', 'color')
 
 
-class TagInline(admin.TabularInline):
-    model = Tag
-    fields = ('slug', 'name', 'color')
-
-
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('id', 'recipe', 'ingredient', 'amount')
+    list_filter = (RecipeFilter,)
+    list_select_related = ('recipe', 'ingredient')
     search_fields = ('recipe__name', 'ingredient__name')
-    inline = [IngredientInline, ]
+    autocomplete_fields = ('recipe', 'ingredient')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -37,24 +51,50 @@ class RecipeIngredientInline(admin.TabularInline):
     autocomplete_fields = ('ingredient',)
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'author', 'pub_date', 'favorite_count')
-    list_filter = ('name', 'author', 'pub_date', 'tags')
-    search_fields = ('name', 'user__username')
-    inline = [RecipeIngredientInline, TagInline]
-
+    list_filter = (AuthorFilter, 'pub_date', 'tags')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username')
+    autocomplete_fields = ('author', 'tags')
+    inlines = [RecipeIngredientInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorite_count=related_count(FavoriteRecipe, 'recipe'))
+
+    @admin.display(description='В избранном', ordering='favorite_count')
     def favorite_count(self, obj):
-        return obj.users_favorite.all().count()
+        return obj.favorite_count
 
 
-class ShoppingListAdmin(admin.ModelAdmin):
+class ShoppingListAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
+    list_filter = (UserFilter, RecipeFilter)
+    list_select_related = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
-class FavoriteRecipeAdmin(admin.ModelAdmin):
+class FavoriteRecipeAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
+    list_filter = (UserFilter, RecipeFilter)
+    list_select_related = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ShoppingListJobAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'created', 'finished')
+    list_filter = (UserFilter, 'status')
+    list_select_related = ('user',)
+    readonly_fields = ('created', 'started', 'finished')
 
 
 admin.site.register(Ingredient, IngredientAdmin)
@@ -63,3 +103,4 @@ admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(ShoppingList, ShoppingListAdmin)
 admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
+admin.site.register(ShoppingListJob, ShoppingListJobAdmin)
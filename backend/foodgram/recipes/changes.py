@@ -0,0 +1,75 @@
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.db import connection
+from django.utils import timezone
+
+from users.models import CustomUser, Subscription
+from .models import Change, FavoriteRecipe, ShoppingList
+
+CHANGE_KINDS = {
+    FavoriteRecipe: Change.FAVORITE,
+    ShoppingList: Change.SHOPPING_CART,
+    Subscription: Change.SUBSCRIPTION,
+}
+
+COMPACT_DUPLICATES_SQL = '''
+    DELETE FROM recipes_change WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id, kind, object_id
+                ORDER BY txid DESC, id DESC
+            ) AS position
+            FROM recipes_change
+        ) AS ranked
+        WHERE position > 1
+    )
+'''
+
+
+def record_changes(kind: str, action: str, object_ids: Iterable[int],
+                   user_id: Optional[int] = None) -> None:
+    """
+    Пишет изменения в журнал. Нужен там, где запись идёт в обход
+    сигналов: сырым SQL или bulk_create.
+    """
+    Change.objects.bulk_create([
+        Change(user_id=user_id, kind=kind, action=action,
+               object_id=object_id)
+        for object_id in object_ids
+    ])
+
+
+def record_removals(kind: str, queryset, user_field: str,
+                    object_field: str) -> None:
+    """
+    Удаление строк queryset одним INSERT ... SELECT: для каскадов,
+    где строки удаляются без сигналов и их может быть много.
+    """
+    sql, params = queryset.order_by().values(
+        user_field, object_field).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO recipes_change '
+            '(user_id, object_id, kind, action, created) '
+            f'SELECT rows.*, %s, %s, %s FROM ({sql}) AS rows',
+            (kind, Change.REMOVED, timezone.now(), *params))
+
+
+def compact_changes(retention: int) -> Dict[str, int]:
+    """
+    Сжимает журнал: удаляет записи старше retention секунд, записи
+    удалённых пользователей и все, кроме последней, записи об одном
+    объекте. Последняя запись и есть итоговое состояние, поэтому
+    клиент с любым ещё действующим курсором получит верный результат.
+    """
+    expired, _ = Change.objects.filter(
+        created__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()
+    orphaned, _ = Change.objects.filter(user_id__isnull=False).exclude(
+        user_id__in=CustomUser.objects.values('id')).delete()
+    with connection.cursor() as cursor:
+        cursor.execute(COMPACT_DUPLICATES_SQL)
+        duplicates = cursor.rowcount
+    return {'expired': expired, 'orphaned': orphaned,
+            'duplicates': duplicates}
@@ -0,0 +1,122 @@
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_SIZES = getattr(
+    settings, 'IMAGE_DERIVATIVE_SIZES', {'small': 160, 'medium': 480})
+DERIVATIVE_FORMATS = getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('webp',))
+DERIVATIVE_QUALITY = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+DERIVATIVE_WORKERS = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+DERIVATIVES_ROOT = 'derivatives'
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'method': 4},
+    'avif': {'format': 'AVIF'},
+    'jpeg': {'format': 'JPEG', 'optimize': True, 'progressive': True},
+}
+
+executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS,
+                              thread_name_prefix='image-derivatives')
+
+
+def variant_keys() -> Iterable[str]:
+    return [f'{size}_{output}' for size in DERIVATIVE_SIZES
+            for output in DERIVATIVE_FORMATS]
+
+
+def derivatives_dir(name: str) -> str:
+    """Каталог производных файлов картинки: имя оригинала без расширения."""
+    return posixpath.join(DERIVATIVES_ROOT, posixpath.splitext(name)[0])
+
+
+def render_variant(image, width: int, output: str) -> bytes:
+    from PIL import Image
+
+    variant = image.copy()
+    variant.thumbnail((width, width * 4), Image.LANCZOS)
+    if output == 'jpeg' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = io.BytesIO()
+    variant.save(buffer, quality=DERIVATIVE_QUALITY, **SAVE_OPTIONS[output])
+    return buffer.getvalue()
+
+
+def build_variants(name: str, force: bool = False) -> Dict[str, str]:
+    """
+    Уменьшенные копии картинки во всех размерах и форматах. Имена
+    зависят только от оригинала, поэтому готовые файлы не пересобираются.
+    """
+    directory = derivatives_dir(name)
+    variants, missing = {}, []
+    for size in DERIVATIVE_SIZES:
+        for output in DERIVATIVE_FORMATS:
+            path = posixpath.join(directory, f'{size}.{output}')
+            variants[f'{size}_{output}'] = path
+            if force or not default_storage.exists(path):
+                missing.append((size, output, path))
+    if not missing:
+        return variants
+    from PIL import Image, ImageOps
+
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name, 'rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        transparent = (image.mode in ('LA', 'PA')
+                       or 'transparency' in image.info)
+        image = image.convert('RGBA' if transparent else 'RGB')
+    for size, output, path in missing:
+        content = render_variant(image, DERIVATIVE_SIZES[size], output)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(content))
+    return variants
+
+
+def update_recipe_variants(recipe_id: int, force: bool = False) -> bool:
+    """
+    Собирает производные картинки рецепта. update() по текущему имени
+    картинки не затрёт варианты, если её успели заменить.
+    """
+    name = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image', flat=True).first()
+    if not name:
+        return False
+    variants = build_variants(name, force)
+    return bool(Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_variants=variants))
+
+
+def run_update(recipe_id: int) -> None:
+    close_old_connections()
+    try:
+        update_recipe_variants(recipe_id)
+    except Exception:
+        logger.exception('Не удалось собрать варианты картинки рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe_id: int) -> None:
+    """Ставит сборку вариантов в пул потоков после фиксации транзакции."""
+    transaction.on_commit(lambda: executor.submit(run_update, recipe_id))
+
+
+def delete_variants(name: str) -> None:
+    directory = derivatives_dir(name)
+    if not default_storage.exists(directory):
+        return
+    for file in default_storage.listdir(directory)[1]:
+        default_storage.delete(posixpath.join(directory, file))
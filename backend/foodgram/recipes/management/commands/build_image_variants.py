@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recipes.derivatives import DERIVATIVE_WORKERS, update_recipe_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build resized and WebP copies of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default=DERIVATIVE_WORKERS, type=int)
+        parser.add_argument('--force', action='store_true',
+                            help='Пересобрать уже готовые копии')
+
+    def build(self, recipe_id, force):
+        try:
+            return update_recipe_variants(recipe_id, force)
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['force']:
+            recipes = recipes.filter(image_variants={})
+        recipe_ids = recipes.order_by('id').values_list('id', flat=True)
+        built = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for updated in pool.map(
+                    lambda recipe_id: self.build(recipe_id, options['force']),
+                    recipe_ids.iterator()):
+                built += updated
+        self.stdout.write(self.style.SUCCESS(
+            f'Собраны копии картинок рецептов: {built}'))
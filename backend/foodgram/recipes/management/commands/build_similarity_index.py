@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import CHUNK_SIZE, index_missing, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the MinHash LSH index of similar recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', default=CHUNK_SIZE, type=int)
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Only index recipes that have no signature yet')
+
+    def handle(self, *args, **options):
+        if options['missing']:
+            total = index_missing(options['chunk_size'])
+        else:
+            total = rebuild_index(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {total}'))
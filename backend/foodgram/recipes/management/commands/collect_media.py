@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.storage import GC_GRACE, media_storage
+
+
+class Command(BaseCommand):
+    help = 'Delete unreferenced files from content-addressed media storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true',
+                            help='Пересчитать ссылки по базе перед сборкой')
+        parser.add_argument('--grace', default=GC_GRACE, type=int)
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            total = media_storage.recount()
+            self.stdout.write(f'Учтено файлов: {total}')
+        removed = media_storage.collect_garbage(options['grace'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {removed}'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes.transfer import CHUNK_SIZE, export_records, open_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Export recipes with tags, ingredients and authors as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='Файл выгрузки (.gz - со сжатием)')
+        parser.add_argument('--chunk-size', default=CHUNK_SIZE, type=int)
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            for line in export_records(options['chunk_size']):
+                self.stdout.write(line, ending='')
+            return
+        lines = 0
+        with open_ndjson(options['output'], 'w') as file:
+            for line in export_records(options['chunk_size']):
+                file.write(line)
+                lines += 1
+        self.stdout.write(self.style.SUCCESS(f'Выгружено строк: {lines}'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.pagination import invalidate_recipe_counts
+from recipes.transfer import (CHUNK_SIZE, Checkpoint, RecipeImporter,
+                              open_ndjson)
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from an NDJSON export, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки (.gz - со сжатием)')
+        parser.add_argument('--batch-size', default=CHUNK_SIZE, type=int)
+        parser.add_argument('--checkpoint',
+                            help='Файл контрольной точки '
+                                 '(по умолчанию <path>.checkpoint)')
+        parser.add_argument('--no-checkpoint', action='store_true')
+
+    def handle(self, *args, **options):
+        checkpoint = None if options['no_checkpoint'] else (
+            options['checkpoint'] or f'{options["path"]}.checkpoint')
+        importer = RecipeImporter(Checkpoint(checkpoint),
+                                  options['batch_size'])
+        try:
+            with open_ndjson(options['path'], 'r') as file:
+                stats = importer.run(file)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {options["path"]} не найден')
+        invalidate_recipe_counts()
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано: ' + ', '.join(
+                f'{model} - {count}' for model, count in stats.items())))
+        self.stdout.write('Картинки рецептов не переносятся: скопируйте '
+                          'media и выполните collect_media --recount.')
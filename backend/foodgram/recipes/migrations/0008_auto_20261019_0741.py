@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-19 07:41
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipeband_recipesignature'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipeingredient',
+            options={'ordering': ('recipe__name', 'id'), 'verbose_name': 'Ингредиент для рецепта', 'verbose_name_plural': 'Ингредиенты для рецепта'},
+        ),
+        migrations.AlterModelOptions(
+            name='tag',
+            options={'ordering': ('id',), 'verbose_name': 'Тег', 'verbose_name_plural': 'Теги'},
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Индекс под поиск ингредиентов по началу названия без учёта регистра
+    (search_fields = ('^name',) в админке и IngredientFilter в API).
+    """
+
+    dependencies = [
+        ('recipes', '0008_auto_20261019_0741'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_idx '
+                'ON recipes_ingredient (UPPER(name::text) text_pattern_ops);'
+            ),
+            reverse_sql=(
+                'DROP INDEX IF EXISTS recipes_ingredient_name_upper_idx;'
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.6 on 2026-10-19 07:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField(verbose_name='Размер файла')),
+                ('offset', models.PositiveIntegerField(default=0, verbose_name='Получено байт')),
+                ('format', models.CharField(blank=True, max_length=8, verbose_name='Формат')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создана')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка картинки',
+                'verbose_name_plural': 'Загрузки картинок',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:04
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, editable=False, help_text='Копия tags для фильтрации без соединения таблиц', size=None, verbose_name='Id тегов'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_ids'], name='recipe_tag_ids_gin'),
+        ),
+        migrations.RunSQL(
+            sql=(
+                'UPDATE recipes_recipe AS recipe SET tag_ids = COALESCE(('
+                'SELECT array_agg(link.tag_id ORDER BY link.tag_id) '
+                'FROM recipes_recipe_tags AS link '
+                "WHERE link.recipe_id = recipe.id), '{}');"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0014_recipe_tag_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('favorite', 'Избранное'), ('shopping_cart', 'Список покупок'), ('subscription', 'Подписка'), ('recipe', 'Рецепт')], max_length=16, verbose_name='Что изменилось')),
+                ('action', models.CharField(choices=[('added', 'Добавлен'), ('removed', 'Удалён'), ('updated', 'Изменён')], max_length=8, verbose_name='Действие')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Id объекта')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создана')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Журнал изменений',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'id'], name='change_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['id'], name='change_recipe_idx'),
+        ),
+    ]
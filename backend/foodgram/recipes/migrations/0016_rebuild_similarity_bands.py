@@ -0,0 +1,54 @@
+import hashlib
+
+from django.conf import settings
+from django.db import migrations
+
+# Копия расчёта корзин из recipes.similarity на момент миграции:
+# код приложения может измениться, а миграция - нет.
+MAX_HASH = (1 << 32) - 1
+BUCKET_MASK = (1 << 63) - 1
+CHUNK_SIZE = 500
+
+
+def band_buckets(signature, bands, rows):
+    buckets = []
+    for band in range(bands):
+        band_rows = signature[band * rows:(band + 1) * rows]
+        digest = hashlib.blake2b(
+            repr((band, band_rows)).encode(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big') & BUCKET_MASK)
+    return buckets
+
+
+def rebuild_bands(apps, schema_editor):
+    """
+    Полосы пересобираются из сохранённых сигнатур: число перестановок
+    не изменилось, изменилось только деление на полосы.
+    """
+    bands_count = getattr(settings, 'SIMILARITY_BANDS', 16)
+    rows = getattr(settings, 'SIMILARITY_NUM_PERM', 64) // bands_count
+    RecipeBand = apps.get_model('recipes', 'RecipeBand')
+    RecipeSignature = apps.get_model('recipes', 'RecipeSignature')
+    RecipeBand.objects.all().delete()
+    bands = []
+    for recipe_id, signature in RecipeSignature.objects.values_list(
+            'recipe_id', 'minhash').iterator(chunk_size=CHUNK_SIZE):
+        if all(value == MAX_HASH for value in signature):
+            continue
+        bands.extend(RecipeBand(recipe_id=recipe_id, bucket=bucket)
+                     for bucket in band_buckets(signature, bands_count, rows))
+        if len(bands) >= CHUNK_SIZE:
+            RecipeBand.objects.bulk_create(bands)
+            bands = []
+    RecipeBand.objects.bulk_create(bands)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_change'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_bands, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:45
+
+from django.db import migrations, models
+
+
+def drop_duplicate_pending(apps, schema_editor):
+    """Из ожидающих задач пользователя остаётся самая новая."""
+    ShoppingListJob = apps.get_model('recipes', 'ShoppingListJob')
+    kept = set()
+    for job in ShoppingListJob.objects.filter(
+            status='pending').order_by('user_id', '-created'):
+        if job.user_id in kept:
+            job.status = 'failed'
+            job.save(update_fields=('status',))
+        kept.add(job.user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_rebuild_similarity_bands'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglistjob',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш списка'),
+        ),
+        migrations.RunPython(drop_duplicate_pending,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppinglistjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('user',), name='unique_pending_shopping_list_job'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.6 on 2026-10-19 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0017_shoppinglistjob_digest'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='change',
+            name='change_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='change',
+            name='change_recipe_idx',
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='txid',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция'),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            sql=(
+                'CREATE FUNCTION recipes_change_set_txid() RETURNS trigger '
+                'AS $$ BEGIN NEW.txid := txid_current(); RETURN NEW; END; $$ '
+                'LANGUAGE plpgsql;'
+                'CREATE TRIGGER recipes_change_txid '
+                'BEFORE INSERT ON recipes_change '
+                'FOR EACH ROW EXECUTE PROCEDURE recipes_change_set_txid();'
+            ),
+            reverse_sql=(
+                'DROP TRIGGER recipes_change_txid ON recipes_change;'
+                'DROP FUNCTION recipes_change_set_txid();'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'txid', 'id'], name='change_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['txid', 'id'], name='change_recipe_idx'),
+        ),
+    ]
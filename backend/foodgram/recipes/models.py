@@ -1,8 +1,13 @@
+import uuid
+
 from colorfield.fields import ColorField
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core import validators
 from django.db import models
 
 from users.models import CustomUser
+from .storage import media_storage
 
 
 class Ingredient(models.Model):
@@ -40,6 +45,7 @@ class Tag(models.Model):
     class Meta:
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
+        ordering = ('id',)
         constraints = [
             models.UniqueConstraint(fields=[
                 'name',
@@ -59,8 +65,15 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=media_storage,
         verbose_name='Изображение блюда'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения'
+    )
     text = models.TextField('Текст рецепта')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -86,6 +99,14 @@ class Recipe(models.Model):
         help_text='Выберите теги рецепта',
         db_index=True
     )
+    tag_ids = ArrayField(
+        models.IntegerField(),
+        default=list,
+        blank=True,
+        editable=False,
+        verbose_name='Id тегов',
+        help_text='Копия tags для фильтрации без соединения таблиц'
+    )
     cooking_time = models.PositiveSmallIntegerField(
         null=False,
         verbose_name='Время приготовления рецепта в минутах',
@@ -97,6 +118,9 @@ class Recipe(models.Model):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            GinIndex(fields=('tag_ids',), name='recipe_tag_ids_gin'),
+        )
 
     def __str__(self):
         return self.name
@@ -124,7 +148,7 @@ class RecipeIngredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент для рецепта'
         verbose_name_plural = 'Ингредиенты для рецепта'
-        ordering = ('recipe__name',)
+        ordering = ('recipe__name', 'id')
         constraints = [
             models.UniqueConstraint(fields=[
                 'ingredient',
@@ -191,3 +215,233 @@ class FavoriteRecipe(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в Избранное'
+
+
+class RecipeSignature(models.Model):
+    """MinHash-сигнатура набора ингредиентов рецепта."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature',
+        verbose_name='Рецепт'
+    )
+    minhash = models.JSONField(verbose_name='MinHash-сигнатура')
+
+    class Meta:
+        verbose_name = 'Сигнатура рецепта'
+        verbose_name_plural = 'Сигнатуры рецептов'
+
+    def __str__(self):
+        return f'Сигнатура рецепта {self.recipe_id}'
+
+
+class RecipeBand(models.Model):
+    """LSH-корзина, в которую попадает полоса сигнатуры рецепта."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='bands',
+        verbose_name='Рецепт'
+    )
+    bucket = models.BigIntegerField(
+        db_index=True,
+        verbose_name='Ключ корзины'
+    )
+
+    class Meta:
+        verbose_name = 'LSH-корзина рецепта'
+        verbose_name_plural = 'LSH-корзины рецептов'
+
+    def __str__(self):
+        return f'Рецепт {self.recipe_id} в корзине {self.bucket}'
+
+
+class ShoppingListJob(models.Model):
+    """Фоновая задача на сборку PDF со списком покупок."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_jobs',
+        verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True,
+        verbose_name='Статус'
+    )
+    file = models.FileField(
+        upload_to='shopping_lists/',
+        blank=True,
+        verbose_name='Файл'
+    )
+    digest = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name='Хэш списка'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана'
+    )
+    started = models.DateTimeField(null=True, blank=True,
+                                   verbose_name='Начата')
+    finished = models.DateTimeField(null=True, blank=True,
+                                    verbose_name='Завершена')
+
+    class Meta:
+        verbose_name = 'Задача списка покупок'
+        verbose_name_plural = 'Задачи списка покупок'
+        ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(status='pending'),
+                name='unique_pending_shopping_list_job')
+        ]
+
+    def __str__(self):
+        return f'Список покупок {self.user} ({self.status})'
+
+
+class StoredFile(models.Model):
+    """Учёт ссылок на файл в хранилище с адресацией по содержимому."""
+    name = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='Имя файла'
+    )
+    refcount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Изменён'
+    )
+
+    class Meta:
+        verbose_name = 'Файл хранилища'
+        verbose_name_plural = 'Файлы хранилища'
+        indexes = [
+            models.Index(fields=('refcount', 'updated'),
+                         name='storedfile_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class ImageUpload(models.Model):
+    """Картинка, загружаемая по частям; id служит токеном для рецепта."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='image_uploads',
+        verbose_name='Пользователь'
+    )
+    size = models.PositiveIntegerField(verbose_name='Размер файла')
+    offset = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Получено байт'
+    )
+    format = models.CharField(
+        max_length=8,
+        blank=True,
+        verbose_name='Формат'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Создана'
+    )
+
+    class Meta:
+        verbose_name = 'Загрузка картинки'
+        verbose_name_plural = 'Загрузки картинок'
+
+    def __str__(self):
+        return f'Загрузка {self.pk}: {self.offset} из {self.size} байт'
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+
+class Change(models.Model):
+    """
+    Запись журнала изменений для синхронизации клиентов. Записи
+    с пустым user - правки рецептов, общие для всех. Связь с
+    пользователем без ограничения в базе: записи удалённых
+    пользователей убирает сжатие журнала. txid - номер транзакции,
+    его ставит триггер в базе (txid_current()).
+    """
+    FAVORITE = 'favorite'
+    SHOPPING_CART = 'shopping_cart'
+    SUBSCRIPTION = 'subscription'
+    RECIPE = 'recipe'
+    KINDS = (
+        (FAVORITE, 'Избранное'),
+        (SHOPPING_CART, 'Список покупок'),
+        (SUBSCRIPTION, 'Подписка'),
+        (RECIPE, 'Рецепт'),
+    )
+    ADDED = 'added'
+    REMOVED = 'removed'
+    UPDATED = 'updated'
+    ACTIONS = (
+        (ADDED, 'Добавлен'),
+        (REMOVED, 'Удалён'),
+        (UPDATED, 'Изменён'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Пользователь'
+    )
+    kind = models.CharField(max_length=16, choices=KINDS,
+                            verbose_name='Что изменилось')
+    action = models.CharField(max_length=8, choices=ACTIONS,
+                              verbose_name='Действие')
+    object_id = models.PositiveIntegerField(verbose_name='Id объекта')
+    txid = models.BigIntegerField(editable=False, verbose_name='Транзакция')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Создана'
+    )
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Журнал изменений'
+        indexes = [
+            models.Index(fields=('user', 'txid', 'id'),
+                         name='change_user_idx'),
+            models.Index(fields=('txid', 'id'), name='change_recipe_idx',
+                         condition=models.Q(user__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}: {self.action}'
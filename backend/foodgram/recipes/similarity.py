@@ -0,0 +1,178 @@
+import hashlib
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Recipe, RecipeBand, RecipeIngredient, RecipeSignature
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+BUCKET_MASK = (1 << 63) - 1
+
+NUM_PERM = getattr(settings, 'SIMILARITY_NUM_PERM', 64)
+# 16 полос по 4 строки: кандидатом рецепт становится с вероятностью
+# ~0.03 при Жаккаре 0.2 и ~0.64 при 0.5.
+BANDS = getattr(settings, 'SIMILARITY_BANDS', 16)
+ROWS = NUM_PERM // BANDS
+TAG_WEIGHT = getattr(settings, 'SIMILARITY_TAG_WEIGHT', 0.5)
+MAX_CANDIDATES = getattr(settings, 'SIMILARITY_MAX_CANDIDATES', 200)
+CHUNK_SIZE = 500
+
+_rng = random.Random(1)
+PERMUTATIONS = [
+    (_rng.randint(1, MERSENNE_PRIME - 1), _rng.randint(0, MERSENNE_PRIME - 1))
+    for _ in range(NUM_PERM)
+]
+
+
+def minhash(ingredient_ids: Iterable[int]) -> List[int]:
+    """MinHash-сигнатура множества ингредиентов рецепта."""
+    ids = set(ingredient_ids)
+    if not ids:
+        return [MAX_HASH] * NUM_PERM
+    return [
+        min(((a * x + b) % MERSENNE_PRIME) & MAX_HASH for x in ids)
+        for a, b in PERMUTATIONS
+    ]
+
+
+def band_buckets(signature: List[int]) -> List[int]:
+    """Ключи LSH-корзин: по одному на каждую полосу сигнатуры."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(
+            repr((band, rows)).encode(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big') & BUCKET_MASK)
+    return buckets
+
+
+def estimate_jaccard(first: List[int], second: List[int]) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам."""
+    return sum(x == y for x, y in zip(first, second)) / NUM_PERM
+
+
+def is_empty(signature: List[int]) -> bool:
+    """Сигнатура рецепта без ингредиентов: похожих у него нет."""
+    return all(value == MAX_HASH for value in signature)
+
+
+def _signature_rows(recipe_id: int, ingredient_ids: Iterable[int]):
+    signature = minhash(ingredient_ids)
+    buckets = [] if is_empty(signature) else band_buckets(signature)
+    return (
+        RecipeSignature(recipe_id=recipe_id, minhash=signature),
+        [RecipeBand(recipe_id=recipe_id, bucket=bucket)
+         for bucket in buckets],
+    )
+
+
+def update_recipe_signature(recipe: Recipe) -> None:
+    """Пересчитывает сигнатуру одного рецепта после смены ингредиентов."""
+    ingredient_ids = RecipeIngredient.objects.filter(
+        recipe=recipe).values_list('ingredient_id', flat=True)
+    signature, bands = _signature_rows(recipe.id, ingredient_ids)
+    with transaction.atomic():
+        RecipeSignature.objects.update_or_create(
+            recipe_id=recipe.id, defaults={'minhash': signature.minhash})
+        RecipeBand.objects.filter(recipe_id=recipe.id).delete()
+        RecipeBand.objects.bulk_create(bands)
+
+
+def index_missing(chunk_size: int = CHUNK_SIZE) -> int:
+    """Добавляет в индекс рецепты без сигнатур."""
+    total = 0
+    while True:
+        chunk = list(Recipe.objects.filter(
+            signature__isnull=True).order_by('id').values_list(
+            'id', flat=True)[:chunk_size])
+        if not chunk:
+            return total
+        with transaction.atomic():
+            total += index_recipes(chunk)
+
+
+def rebuild_index(chunk_size: int = CHUNK_SIZE) -> int:
+    """Полностью перестраивает LSH-индекс пакетными вставками."""
+    total = 0
+    with transaction.atomic():
+        RecipeBand.objects.all().delete()
+        RecipeSignature.objects.all().delete()
+        recipe_ids = Recipe.objects.order_by('id').values_list(
+            'id', flat=True)
+        chunk = []
+        for recipe_id in recipe_ids.iterator(chunk_size=chunk_size):
+            chunk.append(recipe_id)
+            if len(chunk) == chunk_size:
+                total += index_recipes(chunk)
+                chunk = []
+        if chunk:
+            total += index_recipes(chunk)
+    return total
+
+
+def index_recipes(recipe_ids: List[int]) -> int:
+    """Пакетно добавляет в индекс рецепты, у которых ещё нет сигнатур."""
+    ingredients = defaultdict(set)
+    for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id',
+                                                  'ingredient_id'):
+        ingredients[recipe_id].add(ingredient_id)
+    signatures, bands = [], []
+    for recipe_id in recipe_ids:
+        signature, recipe_bands = _signature_rows(
+            recipe_id, ingredients[recipe_id])
+        signatures.append(signature)
+        bands.extend(recipe_bands)
+    RecipeSignature.objects.bulk_create(signatures)
+    RecipeBand.objects.bulk_create(bands)
+    return len(signatures)
+
+
+def _tags_by_recipe(recipe_ids: Iterable[int]) -> Dict[int, set]:
+    tags = defaultdict(set)
+    for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id', 'tag_id'):
+        tags[recipe_id].add(tag_id)
+    return tags
+
+
+def similar_recipes(recipe: Recipe, limit: int) -> List[Tuple[int, float]]:
+    """
+    Похожие рецепты: до MAX_CANDIDATES кандидатов с наибольшим числом
+    общих LSH-корзин, ранжированные по оценке Жаккара ингредиентов
+    с весом за общие теги. Рецепт без сигнатуры (ещё не попал
+    в индекс) и рецепт без ингредиентов похожих не имеют.
+    """
+    try:
+        signature = recipe.signature.minhash
+    except RecipeSignature.DoesNotExist:
+        return []
+    if is_empty(signature):
+        return []
+    candidate_ids = RecipeBand.objects.filter(
+        bucket__in=band_buckets(signature)
+    ).exclude(recipe_id=recipe.id).values('recipe_id').annotate(
+        hits=Count('id')).order_by('-hits', 'recipe_id').values_list(
+        'recipe_id', flat=True)[:MAX_CANDIDATES]
+    candidates = dict(RecipeSignature.objects.filter(
+        recipe_id__in=candidate_ids).values_list(
+        'recipe_id', 'minhash'))
+    if not candidates:
+        return []
+    tags = _tags_by_recipe([recipe.id, *candidates])
+    own_tags = tags[recipe.id]
+    scored = []
+    for recipe_id, candidate in candidates.items():
+        jaccard = estimate_jaccard(signature, candidate)
+        if not jaccard:
+            continue
+        union = own_tags | tags[recipe_id]
+        shared = len(own_tags & tags[recipe_id]) / len(union) if union else 0
+        scored.append((recipe_id, jaccard * (1 + TAG_WEIGHT * shared)))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:limit]
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import posixpath
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+GC_GRACE = getattr(settings, 'MEDIA_GC_GRACE', 60 * 60)
+
+
+def stored_files():
+    return apps.get_model('recipes', 'StoredFile').objects
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище с именами по SHA-256 содержимого, разложенными по
+    каталогам из первых символов хэша: одинаковые загрузки хранятся
+    один раз. Число ссылок на файл ведётся в StoredFile; delete() только
+    снимает ссылку, а файлы без ссылок удаляет collect_garbage().
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, self.content_digest(content))
+        with transaction.atomic():
+            self.add_reference(name)
+            if not self.exists(name):
+                saved = self._save(name, content)
+                if saved != name:
+                    # Тот же файл параллельно записала другая загрузка.
+                    super().delete(saved)
+        return name
+
+    @staticmethod
+    def content_digest(content) -> str:
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hashed_name(name: str, digest: str) -> str:
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2],
+                              digest[2:4], f'{digest}{extension}')
+
+    def add_reference(self, name: str) -> None:
+        if stored_files().filter(name=name).update(
+                refcount=F('refcount') + 1, updated=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                stored_files().create(name=name, refcount=1)
+        except IntegrityError:
+            stored_files().filter(name=name).update(
+                refcount=F('refcount') + 1, updated=timezone.now())
+
+    def delete(self, name: str) -> None:
+        stored_files().filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, updated=timezone.now())
+
+    def referencing_fields(self):
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, FileField) and field.storage is self:
+                    yield model, field
+
+    def recount(self) -> int:
+        """
+        Пересчитывает ссылки по полям моделей. Файлы, загруженные до
+        появления учёта, и осиротевшие файлы на диске получают записи,
+        последние - с нулём ссылок.
+        """
+        references = Counter()
+        directories = set()
+        for model, field in self.referencing_fields():
+            directories.add(str(field.upload_to))
+            names = model._default_manager.exclude(
+                **{field.name: ''}).values_list(field.name, flat=True)
+            references.update(names.iterator())
+        for directory in directories:
+            root = self.path(directory)
+            for path, _, files in os.walk(root):
+                for file in files:
+                    name = posixpath.join(
+                        directory, os.path.relpath(
+                            os.path.join(path, file), root
+                        ).replace(os.sep, '/'))
+                    references.setdefault(name, 0)
+        model = apps.get_model('recipes', 'StoredFile')
+        with transaction.atomic():
+            stored_files().exclude(name__in=list(references)).update(
+                refcount=0)
+            existing = set(stored_files().values_list('name', flat=True))
+            stored_files().bulk_update(
+                [model(name=name, refcount=references[name])
+                 for name in existing & set(references)],
+                ['refcount'], batch_size=500)
+            stored_files().bulk_create(
+                [model(name=name, refcount=count)
+                 for name, count in references.items()
+                 if name not in existing], batch_size=500)
+        return len(references)
+
+    def collect_garbage(self, grace: int = GC_GRACE) -> int:
+        """
+        Удаляет файлы, на которые дольше grace секунд нет ссылок,
+        вместе с их уменьшенными копиями.
+        """
+        from .derivatives import delete_variants
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        names = stored_files().filter(
+            refcount=0, updated__lt=cutoff).values_list('name', flat=True)
+        removed = 0
+        for name in names.iterator():
+            with transaction.atomic():
+                stored = stored_files().select_for_update(
+                    skip_locked=True).filter(name=name, refcount=0).first()
+                if stored is None:
+                    continue
+                super().delete(name)
+                delete_variants(name)
+                stored.delete()
+                removed += 1
+        return removed
+
+
+media_storage = ContentAddressedStorage()
@@ -0,0 +1,35 @@
+from typing import Iterable, Optional
+
+from django.db import connection
+
+from .models import Recipe
+
+SYNC_TAG_IDS_SQL = '''
+    UPDATE recipes_recipe AS recipe
+    SET tag_ids = COALESCE((
+        SELECT array_agg(link.tag_id ORDER BY link.tag_id)
+        FROM recipes_recipe_tags AS link
+        WHERE link.recipe_id = recipe.id
+    ), '{{}}')
+    {where}
+'''
+
+
+def sync_tag_ids(recipe_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Переписывает Recipe.tag_ids по связям рецептов с тегами одним
+    запросом. Без recipe_ids обновляются все рецепты.
+    """
+    with connection.cursor() as cursor:
+        if recipe_ids is None:
+            cursor.execute(SYNC_TAG_IDS_SQL.format(where=''))
+        else:
+            cursor.execute(
+                SYNC_TAG_IDS_SQL.format(where='WHERE recipe.id = ANY(%s)'),
+                [list(recipe_ids)])
+        return cursor.rowcount
+
+
+def recipes_with_tag(tag_id: int) -> Iterable[int]:
+    return Recipe.objects.filter(
+        tag_ids__contains=[tag_id]).values_list('id', flat=True)
@@ -0,0 +1,239 @@
+import gzip
+import json
+import os
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from users.models import CustomUser
+from .changes import record_changes
+from .models import Change, Ingredient, Recipe, RecipeIngredient, Tag
+from .similarity import index_recipes
+from .tagging import sync_tag_ids
+
+CHUNK_SIZE = 2000
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'bio',
+               'date_joined')
+
+
+def open_ndjson(path: str, mode: str) -> TextIO:
+    """Файл NDJSON; файлы .gz сжимаются и распаковываются на лету."""
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def record(model: str, **fields) -> str:
+    return json.dumps({'model': model, **fields}, ensure_ascii=False,
+                      default=str) + '\n'
+
+
+def export_records(chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Строки NDJSON: теги, ингредиенты, авторы, затем рецепты. Ссылки
+    на связанные объекты идут по естественным ключам (слаг, название
+    с единицей, username), а не по id исходной базы.
+    """
+    for tag in Tag.objects.order_by('id').values(
+            'name', 'color', 'slug').iterator(chunk_size=chunk_size):
+        yield record('tag', **tag)
+    for ingredient in Ingredient.objects.order_by('id').values(
+            'name', 'measurement_unit').iterator(chunk_size=chunk_size):
+        yield record('ingredient', **ingredient)
+    authors = CustomUser.objects.filter(
+        id__in=Recipe.objects.values('author_id')).order_by('id')
+    for user in authors.values(*USER_FIELDS).iterator(chunk_size=chunk_size):
+        yield record('user', **user)
+    recipes = Recipe.objects.order_by('id').values(
+        'id', 'name', 'text', 'image', 'cooking_time', 'pub_date',
+        'author__username')
+    chunk = []
+    for recipe in recipes.iterator(chunk_size=chunk_size):
+        chunk.append(recipe)
+        if len(chunk) == chunk_size:
+            yield from export_recipe_chunk(chunk)
+            chunk = []
+    yield from export_recipe_chunk(chunk)
+
+
+def export_recipe_chunk(chunk: List[dict]) -> Iterator[str]:
+    recipe_ids = [recipe['id'] for recipe in chunk]
+    tags = defaultdict(list)
+    for recipe_id, slug in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids).order_by('tag_id').values_list(
+            'recipe_id', 'tag__slug'):
+        tags[recipe_id].append(slug)
+    ingredients = defaultdict(list)
+    for recipe_id, name, unit, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).order_by('id').values_list(
+            'recipe_id', 'ingredient__name',
+            'ingredient__measurement_unit', 'amount'):
+        ingredients[recipe_id].append([name, unit, amount])
+    for recipe in chunk:
+        yield record(
+            'recipe',
+            name=recipe['name'],
+            text=recipe['text'],
+            image=recipe['image'],
+            cooking_time=recipe['cooking_time'],
+            pub_date=recipe['pub_date'].isoformat(),
+            author=recipe['author__username'],
+            tags=tags[recipe['id']],
+            ingredients=ingredients[recipe['id']],
+        )
+
+
+class Checkpoint:
+    """Номер последней импортированной строки для продолжения импорта."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+
+    def load(self) -> int:
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as file:
+            return json.load(file)['line']
+
+    def save(self, line: int) -> None:
+        if not self.path:
+            return
+        with open(f'{self.path}.tmp', 'w') as file:
+            json.dump({'line': line}, file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def clear(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RecipeImporter:
+    """
+    Пакетный импорт выгрузки export_records. Новые объекты получают
+    новые id, ссылки переводятся на них по естественным ключам; уже
+    существующие теги, ингредиенты, пользователи и рецепты с тем же
+    ключом не дублируются. После каждого пакета сохраняется checkpoint.
+    """
+
+    def __init__(self, checkpoint: Checkpoint, batch_size: int = CHUNK_SIZE):
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.tags: Dict[str, int] = {}
+        self.ingredients: Dict[tuple, int] = {}
+        self.stats = defaultdict(int)
+
+    def run(self, lines: Iterator[str]) -> Dict[str, int]:
+        start = self.checkpoint.load()
+        batch, number = [], 0
+        for number, line in enumerate(lines, 1):
+            if number <= start or not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch, number)
+                batch = []
+        if batch:
+            self.import_batch(batch, number)
+        self.checkpoint.clear()
+        return dict(self.stats)
+
+    def import_batch(self, batch: List[dict], line: int) -> None:
+        by_model = defaultdict(list)
+        for item in batch:
+            by_model[item.pop('model')].append(item)
+        with transaction.atomic():
+            self.import_tags(by_model['tag'])
+            self.import_ingredients(by_model['ingredient'])
+            self.import_users(by_model['user'])
+            self.import_recipes(by_model['recipe'])
+        self.checkpoint.save(line)
+
+    def import_tags(self, items: List[dict]) -> None:
+        if not items:
+            return
+        Tag.objects.bulk_create([Tag(**item) for item in items],
+                                ignore_conflicts=True)
+        self.stats['tag'] += len(items)
+
+    def import_ingredients(self, items: List[dict]) -> None:
+        if not items:
+            return
+        Ingredient.objects.bulk_create(
+            [Ingredient(**item) for item in items], ignore_conflicts=True)
+        self.stats['ingredient'] += len(items)
+
+    def import_users(self, items: List[dict]) -> None:
+        if not items:
+            return
+        password = make_password(None)
+        users = []
+        for item in items:
+            item['date_joined'] = parse_datetime(item['date_joined'])
+            users.append(CustomUser(password=password, **item))
+        CustomUser.objects.bulk_create(users, ignore_conflicts=True)
+        self.stats['user'] += len(items)
+
+    def resolve_tags(self, slugs) -> None:
+        missing = set(slugs) - set(self.tags)
+        if missing:
+            self.tags.update(Tag.objects.filter(
+                slug__in=missing).values_list('slug', 'id'))
+
+    def resolve_ingredients(self, keys) -> None:
+        missing = set(keys) - set(self.ingredients)
+        names = {name for name, _ in missing}
+        if names:
+            for name, unit, pk in Ingredient.objects.filter(
+                    name__in=names).values_list(
+                    'name', 'measurement_unit', 'id'):
+                self.ingredients[(name, unit)] = pk
+
+    def import_recipes(self, items: List[dict]) -> None:
+        if not items:
+            return
+        authors = dict(CustomUser.objects.filter(
+            username__in={item['author'] for item in items}
+        ).values_list('username', 'id'))
+        existing = set(Recipe.objects.filter(
+            name__in=[item['name'] for item in items]
+        ).values_list('name', flat=True))
+        self.resolve_tags(
+            slug for item in items for slug in item['tags'])
+        self.resolve_ingredients(
+            (name, unit) for item in items
+            for name, unit, _ in item['ingredients'])
+        fresh = [item for item in items
+                 if item['name'] not in existing
+                 and item['author'] in authors]
+        self.stats['recipe_skipped'] += len(items) - len(fresh)
+        recipes = Recipe.objects.bulk_create([
+            Recipe(name=item['name'], text=item['text'],
+                   image=item['image'], cooking_time=item['cooking_time'],
+                   author_id=authors[item['author']])
+            for item in fresh
+        ])
+        Recipe.objects.bulk_update(
+            [Recipe(pk=recipe.pk, pub_date=parse_datetime(item['pub_date']))
+             for recipe, item in zip(recipes, fresh)], ['pub_date'])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.pk,
+                                tag_id=self.tags[slug])
+            for recipe, item in zip(recipes, fresh)
+            for slug in item['tags'] if slug in self.tags
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe_id=recipe.pk,
+                             ingredient_id=self.ingredients[(name, unit)],
+                             amount=amount)
+            for recipe, item in zip(recipes, fresh)
+            for name, unit, amount in item['ingredients']
+            if (name, unit) in self.ingredients
+        ])
+        sync_tag_ids([recipe.pk for recipe in recipes])
+        index_recipes([recipe.pk for recipe in recipes])
+        record_changes(Change.RECIPE, Change.UPDATED,
+                       [recipe.pk for recipe in recipes])
+        self.stats['recipe'] += len(recipes)
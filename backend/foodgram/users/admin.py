@@ -1,25 +1,60 @@
 from django.contrib import admin
 
-from .models import CustomUser, Subscription
+from api.admin import (AutocompleteFilter, AutocompleteFilterMixin,
+                       related_count)
+from api.pagination import EstimatedCountPaginator
+from .models import AccountDeletion, CustomUser, Subscription
+
+
+class UserFilter(AutocompleteFilter):
+    title = 'Подписчик'
+    field_name = 'user'
+
+
+class AuthorFilter(AutocompleteFilter):
+    title = 'Автор'
+    field_name = 'author'
 
 
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'first_name', 'last_name', 'email',
                     'date_joined', 'subscribers_count')
-    list_filter = ('username', 'email')
+    list_filter = ('is_staff', 'is_active')
+    readonly_fields = ('deleted_at',)
     search_fields = ('username', 'email')
     ordering = ('id',)
     empty_value_display = '--empty--'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            subscribers_count=related_count(Subscription, 'user'))
+
+    @admin.display(ordering='subscribers_count')
     def subscribers_count(self, obj):
-        return obj.subscriber.all().count()
+        return obj.subscribers_count
 
 
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'author')
-    list_filter = ('user', 'author')
-    search_fields = ('user', 'author')
+    list_filter = (UserFilter, AuthorFilter)
+    list_select_related = ('user', 'author')
+    search_fields = ('user__username', 'author__username')
+    autocomplete_fields = ('user', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'status', 'stage', 'created', 'updated',
+                    'finished')
+    list_filter = ('status',)
+    search_fields = ('email',)
+    readonly_fields = ('user', 'email', 'status', 'stage', 'deleted',
+                       'created', 'started', 'updated', 'finished')
 
 
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(AccountDeletion, AccountDeletionAdmin)
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_remove_customuser_subscribing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='Email адрес')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово')], db_index=True, default='pending', max_length=16, verbose_name='Статус')),
+                ('stage', models.CharField(blank=True, max_length=32, verbose_name='Шаг')),
+                ('deleted', models.JSONField(default=dict, verbose_name='Удалено строк')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Последняя пачка')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Удаление аккаунта',
+                'verbose_name_plural': 'Удаления аккаунтов',
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Аккаунт скрыт и ждёт удаления связанных данных', null=True, verbose_name='Удалён'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='user_deleted_idx'),
+        ),
+        migrations.AddField(
+            model_name='accountdeletion',
+            name='user',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deletion', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -17,6 +17,9 @@ class CustomUser(AbstractUser):
     last_name = models.CharField('Фамилия', max_length=150, blank=True)
     date_joined = models.DateTimeField('Дата создания', default=timezone.now)
     bio = models.CharField('Биография', max_length=200, blank=True, default=1)
+    deleted_at = models.DateTimeField(
+        'Удалён', null=True, blank=True, editable=False,
+        help_text='Аккаунт скрыт и ждёт удаления связанных данных')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
@@ -33,6 +36,10 @@ class CustomUser(AbstractUser):
                 'email'
             ], name='unique_user'),
         ]
+        indexes = [
+            models.Index(fields=('deleted_at',), name='user_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     def __str__(self):
         return f'{self.username}'
@@ -62,3 +69,45 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f'{self.user} подписался на {self.author}'
+
+
+class AccountDeletion(models.Model):
+    """
+    Удаление данных скрытого аккаунта пачками. Запись остаётся и после
+    удаления пользователя: в deleted - сколько строк удалено на каждом
+    шаге, в stage - текущий шаг.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+    )
+
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='deletion',
+        verbose_name='Пользователь'
+    )
+    email = models.EmailField('Email адрес')
+    status = models.CharField(
+        'Статус', max_length=16, choices=STATUSES, default=PENDING,
+        db_index=True)
+    stage = models.CharField('Шаг', max_length=32, blank=True)
+    deleted = models.JSONField('Удалено строк', default=dict)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    started = models.DateTimeField('Начата', null=True, blank=True)
+    updated = models.DateTimeField('Последняя пачка', auto_now=True)
+    finished = models.DateTimeField('Завершена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Удаление аккаунта'
+        verbose_name_plural = 'Удаления аккаунтов'
+        ordering = ('created',)
+
+    def __str__(self):
+        return f'Удаление {self.email} ({self.status})'